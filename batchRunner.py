@@ -0,0 +1,186 @@
+"""Runs many attack scenarios, each in its own db, in a pool of worker processes
+
+    A scenario is a dict:
+        'sql': the query the base table is built for
+        'strip': optional {'table':..., 'query':..., 'numLeft':..., 'pick':..., 'seed':...},
+            passed to rowFiller.stripAllButX() (numLeft defaults to 1, and can be a
+            dict of aid column to number of aids left)
+        'attacks': list of sql queries run against the db once it is built
+        'options': optional rowFiller keyword arguments, like {'aidSpec':['zipf']}
+        'name': optional, defaults to the scenario's position in the batch
+    'profile': optional, if true the scenario's result has a phaseProfiler report
+    A scenario file is a json list of scenarios, or json lines with one scenario
+    per line.
+"""
+import io
+import os
+import sys
+import json
+import time
+import pprint
+import argparse
+import contextlib
+import concurrent.futures
+import whereParser
+import rowFiller
+import tableCache
+import phaseProfiler
+
+# The scenario from rowFiller's __main__. The attack is where there is one user with
+# i1=12345, and we want to know if that user has t1='y'. Stripping leaves one user
+# that has i1=12345 but not t1='y'.
+exampleScenarios = [
+    {'name':'victimNotY',
+     'sql':"select count(*) from tab where t1='y' or i1=12345",
+     'strip':{'table':'tab','query':"t1 != 'y' and i1 == 12345"},
+     'attacks':["select count(*) from tab where t1='y' or i1=12345",
+                "select count(*) from tab where t1='y'"]},
+]
+
+def loadScenarios(path):
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def runScenario(scenario):
+    ''' Builds the scenario's db, strips it and runs its attacks. Returns the
+        scenario's result (a json-ready dict). A scenario that fails gets an
+        'error' entry rather than stopping the batch.
+    '''
+    start = time.perf_counter()
+    result = {'name':scenario['name'],'sql':scenario['sql']}
+    rf = None
+    # Anything the scenario prints is kept, since that is where its errors are told
+    output = io.StringIO()
+    try:
+        options = {'useTestDbName':False,'printIntermediateTables':False}
+        options.update(scenario.get('options',{}))
+        if scenario.get('cacheDir'):
+            options['dbCache'] = tableCache.tableCache(scenario['cacheDir'])
+        profiler = None
+        if scenario.get('profile'):
+            profiler = phaseProfiler.phaseProfiler()
+        with contextlib.redirect_stdout(output):
+            sw = whereParser.simpleWhere(scenario['sql'],profiler=profiler)
+            rf = rowFiller.rowFiller(sw,dbPath=scenario['dbPath'],profiler=profiler,**options)
+            rf.makeBaseTables()
+            rf.baseTablesToDb()
+            if scenario.get('strip'):
+                strip = scenario['strip']
+                rf.stripAllButX(strip['table'],strip['query'],strip.get('numLeft',1),
+                                strip.get('pick','first'),strip.get('seed',0))
+        attacks = scenario.get('attacks',[])
+        answers = rf.queryDbBatch(attacks)
+        result['answers'] = [{'sql':attacks[i],'answer':answers[i]} for i in range(len(attacks))]
+        result['numRows'] = {table:len(df) for table,df in rf.baseDf.items()}
+        result['coverage'] = rf.coverageReport
+        result['failedCombinations'] = rf.failedCombinations
+        if profiler is not None:
+            result['profile'] = profiler.getReport()
+    except (Exception,SystemExit) as e:
+        # The modules here report errors with print() and quit(), which raises SystemExit
+        errors = [line for line in output.getvalue().splitlines() if line.startswith('ERROR')]
+        if type(e) is SystemExit and len(errors) > 0:
+            result['error'] = errors[-1]
+        else:
+            result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if rf is not None:
+            rf.closeDb()
+        if scenario['dbPath'] != ':memory:' and os.path.exists(scenario['dbPath']):
+            if not scenario.get('keepDb',False):
+                os.remove(scenario['dbPath'])
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def runBatch(scenarios,numWorkers=None,dbDir='tables',inMemory=False,keepDbs=False,cacheDir=None,
+             profile=False):
+    ''' Runs the scenarios and returns one report of all of them. Each scenario gets
+        its own db: dbDir/batch<pid>_<position>.db, or an in-memory db if inMemory
+        is True. The dbs are removed when the scenario is done unless keepDbs is True.
+        With cacheDir, the generated tables are shared through a tableCache there,
+        so scenarios that only differ in their strip or attacks build them once.
+        With profile, every scenario is profiled, and the report adds them up.
+    '''
+    jobs = []
+    for i in range(len(scenarios)):
+        job = dict(scenarios[i])
+        job.setdefault('name',str(i))
+        if inMemory:
+            job['dbPath'] = ':memory:'
+        else:
+            job['dbPath'] = os.path.join(dbDir,f"batch{os.getpid()}_{i}.db")
+        job['keepDb'] = keepDbs
+        job['cacheDir'] = cacheDir
+        if profile:
+            job['profile'] = True
+        jobs.append(job)
+    if not inMemory:
+        os.makedirs(dbDir,exist_ok=True)
+    if numWorkers is None:
+        numWorkers = os.cpu_count() or 1
+    start = time.perf_counter()
+    if numWorkers == 1:
+        results = [runScenario(job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(numWorkers) as pool:
+            # Hand out several scenarios per task so that short scenarios aren't
+            # swamped by the cost of sending them to the workers
+            chunksize = max(1,len(jobs) // (numWorkers * 8))
+            results = list(pool.map(runScenario,jobs,chunksize=chunksize))
+    seconds = time.perf_counter() - start
+    return makeReport(results,seconds)
+
+def makeReport(results,seconds):
+    failedCombinations = []
+    profiler = phaseProfiler.phaseProfiler()
+    for result in results:
+        for failed in result.get('failedCombinations',[]):
+            failedCombinations.append({'scenario':result['name'],**failed})
+        if 'profile' in result:
+            profiler.merge(result['profile'])
+    return {'numScenarios':len(results),
+            'numErrors':sum(1 for result in results if 'error' in result),
+            'seconds':seconds,
+            'scenariosPerMinute':60 * len(results) / seconds if seconds > 0 else None,
+            'numFailedCombinations':len(failedCombinations),
+            'failedCombinations':failedCombinations,
+            'profile':profiler.getReport(),
+            'scenarios':results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a batch of attack scenarios")
+    parser.add_argument('scenarios',nargs='?',
+            help="json (or json lines) file of scenarios; runs the example scenario if absent")
+    parser.add_argument('--workers',type=int,default=None,
+            help="number of worker processes (default: one per cpu)")
+    parser.add_argument('--dbDir',default='tables',help="directory for the scenario dbs")
+    parser.add_argument('--memory',action='store_true',help="use in-memory dbs")
+    parser.add_argument('--keepDbs',action='store_true',help="keep the scenario dbs")
+    parser.add_argument('--cacheDir',help="keep generated tables in a table cache here")
+    parser.add_argument('--profile',action='store_true',help="time the phases of each scenario")
+    parser.add_argument('--report',help="write the full report to this json file")
+    args = parser.parse_args(argv)
+    scenarios = exampleScenarios if args.scenarios is None else loadScenarios(args.scenarios)
+    report = runBatch(scenarios,numWorkers=args.workers,dbDir=args.dbDir,
+                      inMemory=args.memory,keepDbs=args.keepDbs,cacheDir=args.cacheDir,
+                      profile=args.profile)
+    if args.report:
+        with open(args.report,'w') as f:
+            json.dump(report,f,indent=2,default=str)
+    pp = pprint.PrettyPrinter(indent=4)
+    summary = {key:value for key,value in report.items() if key not in ['failedCombinations','scenarios']}
+    pp.pprint(summary)
+    for result in report['scenarios']:
+        if 'error' in result:
+            print(f"ERROR: scenario {result['name']}: {result['error']}")
+        elif not args.report:
+            print(f"{result['name']}:")
+            for answer in result['answers']:
+                print(f"    {answer['sql']}: {answer['answer']}")
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,330 @@
+"""Benchmarks the generator on synthetic WHERE clauses
+
+    Each case is a clause made by makeClause() and a number of rows per combination.
+    A case is run through every stage of an attack: parsing (simpleWhere),
+    makeBaseTables(), baseTablesToDb(), stripAllButX() and queryDb(). For each
+    stage we keep the best wall time over the repeats, the peak memory traced by
+    tracemalloc (in a separate run, since tracing slows things down) and, where
+    the stage makes rows or answers queries, the rows or queries per second.
+
+    The cases vary one thing at a time from a base case: the number of
+    conditions, the length of IN() lists, the rows per combination, the column
+    type (every column of one type) and the operation (every condition the
+    same operation, on the column types that have it). Results
+    can be saved as a baseline, and later runs compared with it to show regressions.
+
+        python benchmark.py --save baseline.json
+        python benchmark.py --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import whereParser
+import rowFiller
+
+# The stages of a case, in the order they run
+stages = ['parse','makeBaseTables','baseTablesToDb','stripAllButX','queryDb']
+
+# The operations makeClause() picks from, per column type
+clauseOperations = {'i':['eq','neq','lt','gt','between','in'],
+                    'r':['eq','neq','lt','gt','between'],
+                    't':['eq','neq','in']}
+
+# A stage is only a regression if it is slower than the baseline by at least this
+# many seconds, so that noise in very short stages isn't reported
+minSecondsChange = 0.005
+
+def makeClause(numConditions,inListSize=3,colTypes='irt',numColumns=None,seed=0,firstIn=False,
+               operation=None):
+    ''' Returns the sql of a count query on table tab whose WHERE clause has
+        numConditions conditions, joined at random by AND and OR. Condition i is
+        on column (i mod numColumns), which is of type colTypes[column mod
+        len(colTypes)]. Each condition's operation is picked at random, or is
+        `operation` if given. An IN() list has inListSize values, and with firstIn
+        the first condition is always an IN().
+
+        The values of each IN() list come from a generator of their own, so
+        clauses that differ only in inListSize are the same clause, with IN()
+        lists that grow by adding values.
+    '''
+    rng = random.Random(seed)
+    if numColumns is None:
+        numColumns = numConditions
+    conditions = []
+    for i in range(numConditions):
+        column = i % numColumns
+        colType = colTypes[column % len(colTypes)]
+        # Picked even when operation is given, so that the rest of the clause is
+        # the same whatever the operation
+        conditionOperation = rng.choice(clauseOperations[colType])
+        if operation is not None:
+            if operation not in clauseOperations[colType]:
+                print(f"ERROR: makeClause: operation {operation} is not made for column type {colType}")
+                quit()
+            conditionOperation = operation
+        if i == 0 and firstIn:
+            conditionOperation = 'in'
+        inRng = random.Random(f"{seed}-{i}")
+        conditions.append(_makeCondition(rng,inRng,f"{colType}{column+1}",colType,conditionOperation,inListSize))
+    where = conditions[0]
+    for condition in conditions[1:]:
+        where += f" {rng.choice(['and','or'])} {condition}"
+    return f"select count(*) from tab where {where}"
+
+def _makeCondition(rng,inRng,colName,colType,operation,inListSize):
+    # Every condition takes the same number of values from rng, whatever it is
+    values = [_makeValue(rng,colType) for _ in range(2)]
+    if operation == 'in':
+        inValues = [_makeValue(inRng,colType) for _ in range(inListSize)]
+        return f"{colName} in ({', '.join(inValues)})"
+    if operation == 'between':
+        low,high = sorted(values[:2],key=float)
+        return f"{colName} between {low} and {high}"
+    symbols = {'eq':'=','neq':'<>','lt':'<','gt':'>'}
+    return f"{colName} {symbols[operation]} {values[0]}"
+
+def _makeValue(rng,colType):
+    if colType == 'i':
+        return str(rng.randint(1,1000))
+    if colType == 'r':
+        # Halves are exact in binary, so conditions on them behave predictably
+        return str(rng.randint(2,2000) / 2)
+    return "'" + ''.join(rng.choice('abcdefghij') for _ in range(3)) + "'"
+
+def makeCases(quick=False):
+    ''' Returns the cases, as dicts of name, sql and numRowsPerCombination '''
+    conditionCounts = [2,4,6] if quick else [2,4,6,8,10]
+    inListSizes = [1,4,16] if quick else [1,4,16,64]
+    rowCounts = [1,10,100] if quick else [1,10,100,1000]
+    cases = []
+    for numConditions in conditionCounts:
+        cases.append({'name':f"conditions{numConditions}",
+                      'sql':makeClause(numConditions),
+                      'numRowsPerCombination':1})
+    for inListSize in inListSizes:
+        cases.append({'name':f"inList{inListSize}",
+                      'sql':makeClause(4,inListSize=inListSize,colTypes='it',firstIn=True),
+                      'numRowsPerCombination':1})
+    for numRows in rowCounts:
+        cases.append({'name':f"rows{numRows}",
+                      'sql':makeClause(4),
+                      'numRowsPerCombination':numRows})
+    for colType in clauseOperations:
+        cases.append({'name':f"types_{colType}",
+                      'sql':makeClause(4,colTypes=colType),
+                      'numRowsPerCombination':1})
+    for operation in ['eq','neq','lt','gt','between','in']:
+        colTypes = ''.join(colType for colType in clauseOperations if operation in clauseOperations[colType])
+        cases.append({'name':f"op_{operation}",
+                      'sql':makeClause(4,colTypes=colTypes,operation=operation),
+                      'numRowsPerCombination':1})
+    return cases
+
+def runCase(case,directory,repeat=3,traceMemory=True):
+    ''' Runs the case once per repeat, and once more with tracemalloc if traceMemory
+        is True. Returns {stage: {'seconds':..., 'peakBytes':..., ...}}.
+    '''
+    results = {stage:{'seconds':None} for stage in stages}
+    runs = [False] * repeat
+    if traceMemory:
+        runs.append(True)
+    for traced in runs:
+        timings = _runStages(case,directory,traced)
+        for stage in stages:
+            seconds,peakBytes,counts = timings[stage]
+            if traced:
+                results[stage]['peakBytes'] = peakBytes
+                continue
+            if results[stage]['seconds'] is None or seconds < results[stage]['seconds']:
+                results[stage]['seconds'] = seconds
+            results[stage].update(counts)
+    for stage in stages:
+        seconds = results[stage]['seconds']
+        if seconds is None or seconds == 0:
+            continue
+        if 'numRows' in results[stage]:
+            results[stage]['rowsPerSecond'] = results[stage]['numRows'] / seconds
+        if 'numQueries' in results[stage]:
+            results[stage]['queriesPerSecond'] = results[stage]['numQueries'] / seconds
+    return results
+
+def _runStages(case,directory,traced):
+    ''' Runs the stages once. Returns {stage: (seconds, peak bytes, counts)}, with
+        peak bytes None unless traced
+    '''
+    timings = {}
+    dbPath = os.path.join(directory,f"{case['name']}.db")
+    def run(stage,work):
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        counts = work()
+        seconds = time.perf_counter() - start
+        peakBytes = None
+        if traced:
+            peakBytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        timings[stage] = (seconds,peakBytes,counts or {})
+    state = {}
+    def parse():
+        # A parse cache of our own, so that the sql is really parsed
+        state['sw'] = whereParser.simpleWhere(case['sql'],cache=whereParser.parseCache())
+    def makeBaseTables():
+        state['rf'] = rowFiller.rowFiller(state['sw'],printIntermediateTables=False,useTestDbName=False,
+                                          numRowsPerCombination=case['numRowsPerCombination'],
+                                          dbPath=dbPath)
+        state['rf'].makeBaseTables()
+        return {'numRows':sum(len(df) for df in state['rf'].baseDf.values())}
+    def baseTablesToDb():
+        state['rf'].baseTablesToDb()
+        return {'numRows':sum(len(df) for df in state['rf'].baseDf.values())}
+    def stripAllButX():
+        table,query = _makeStripQuery(state['rf'])
+        state['rf'].stripAllButX(table,query)
+    def queryDb():
+        sqls = _makeQueries(state['sw'])
+        state['rf'].queryDbBatch(sqls)
+        return {'numQueries':len(sqls)}
+    run('parse',parse)
+    run('makeBaseTables',makeBaseTables)
+    run('baseTablesToDb',baseTablesToDb)
+    run('stripAllButX',stripAllButX)
+    run('queryDb',queryDb)
+    state['rf'].closeDb()
+    if os.path.exists(dbPath):
+        os.remove(dbPath)
+    return timings
+
+def _makeStripQuery(rf):
+    ''' Strips to the value of the first column in the first row, which always matches
+        some rows
+    '''
+    table = next(iter(rf.baseDf))
+    df = rf.baseDf[table]
+    column = [column for column in df.columns if column not in rf.getAidColumns()][0]
+    value = df[column].iloc[0]
+    if hasattr(value,'item'):
+        # A numpy scalar, whose repr may not be a python literal
+        value = value.item()
+    return table,f"{column} == {value!r}"
+
+def _makeQueries(sw):
+    ''' The clause itself, and a count query for each of its conditions '''
+    sqls = [sw.sqlStr]
+    for table in sw.iterTabs():
+        for column in sw.iterCols(table):
+            sqls.append(f"select count(*) from {table} where {column} is not null")
+        for condition in sw.iterConditions(table):
+            operands = sw.getOperands(condition)
+            if sw.getOperation(condition) in ['eq','neq','lt','gt']:
+                symbols = {'eq':'=','neq':'<>','lt':'<','gt':'>'}
+                value = operands[0]
+                if type(value) is str:
+                    value = f"'{value}'"
+                sqls.append(f"select count(*) from {table} where {sw.getColName(condition)} "
+                            f"{symbols[sw.getOperation(condition)]} {value}")
+    return sqls
+
+def runBenchmark(cases,repeat=3,traceMemory=True,directory=None):
+    ''' Runs the cases and returns the report (which json can encode) '''
+    ownDirectory = directory is None
+    if ownDirectory:
+        directory = tempfile.mkdtemp(prefix='benchmark')
+    results = {}
+    try:
+        # A small case first, so that loading the lazily imported modules (and
+        # anything else done once) isn't timed as part of the first case
+        _runStages({'name':'warmUp','sql':makeClause(2),'numRowsPerCombination':1},directory,False)
+        for case in cases:
+            results[case['name']] = {'sql':case['sql'],
+                                     'numRowsPerCombination':case['numRowsPerCombination'],
+                                     'stages':runCase(case,directory,repeat,traceMemory)}
+    finally:
+        if ownDirectory:
+            shutil.rmtree(directory,ignore_errors=True)
+    return {'python':platform.python_version(),
+            'platform':platform.platform(),
+            'numpy':rowFiller.np.__version__,
+            'pandas':rowFiller.pd.__version__,
+            'repeat':repeat,
+            'cases':results}
+
+def compareReports(baseline,report,tolerance=1.25):
+    ''' Returns the regressions of report against baseline: the stages of cases in
+        both that take more than tolerance times the baseline's seconds (and at
+        least minSecondsChange more) or peak memory
+    '''
+    regressions = []
+    for name,case in report['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        for stage,result in case['stages'].items():
+            base = baseline['cases'][name]['stages'].get(stage)
+            if base is None:
+                continue
+            for measure in ['seconds','peakBytes']:
+                if result.get(measure) is None or base.get(measure) is None:
+                    continue
+                if result[measure] <= base[measure] * tolerance:
+                    continue
+                if measure == 'seconds' and result[measure] - base[measure] < minSecondsChange:
+                    continue
+                regressions.append({'case':name,
+                                    'stage':stage,
+                                    'measure':measure,
+                                    'baseline':base[measure],
+                                    'now':result[measure],
+                                    'ratio':result[measure] / base[measure] if base[measure] else None})
+    return regressions
+
+def printReport(report):
+    print(f"{'case':<14}{'stage':<16}{'seconds':>10}{'peak MB':>10}{'rows/s':>12}{'queries/s':>11}")
+    for name,case in report['cases'].items():
+        for stage in stages:
+            result = case['stages'][stage]
+            peakBytes = result.get('peakBytes')
+            peak = f"{peakBytes / 2**20:.2f}" if peakBytes is not None else '-'
+            rowsPerSecond = f"{result['rowsPerSecond']:.0f}" if 'rowsPerSecond' in result else '-'
+            queriesPerSecond = f"{result['queriesPerSecond']:.0f}" if 'queriesPerSecond' in result else '-'
+            print(f"{name:<14}{stage:<16}{result['seconds']:>10.4f}{peak:>10}{rowsPerSecond:>12}{queriesPerSecond:>11}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generator on synthetic WHERE clauses")
+    parser.add_argument('--quick',action='store_true',help="fewer and smaller cases")
+    parser.add_argument('--repeat',type=int,default=3,help="timed runs per case (the best is kept)")
+    parser.add_argument('--noMemory',action='store_true',help="skip the tracemalloc run")
+    parser.add_argument('--cases',help="only run the cases whose names start with this")
+    parser.add_argument('--save',help="write the report to this json file (a baseline)")
+    parser.add_argument('--compare',help="compare with the baseline in this json file")
+    parser.add_argument('--tolerance',type=float,default=1.25,
+            help="slowdown (or memory growth) factor reported as a regression")
+    args = parser.parse_args(argv)
+    cases = makeCases(args.quick)
+    if args.cases:
+        cases = [case for case in cases if case['name'].startswith(args.cases)]
+    report = runBenchmark(cases,repeat=args.repeat,traceMemory=not args.noMemory)
+    printReport(report)
+    if args.save:
+        with open(args.save,'w') as f:
+            json.dump(report,f,indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compareReports(baseline,report,args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression['case']} {regression['stage']} {regression['measure']}: "
+                  f"{regression['baseline']:.4g} -> {regression['now']:.4g}")
+        if len(regressions) > 0:
+            return 1
+        print("No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
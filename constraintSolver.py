@@ -0,0 +1,240 @@
+import math
+import bisect
+import pprint
+import whereEvaluator
+
+class constraintSolver:
+    """ Finds a value for one column that gives the wanted True/False result for every
+        condition on the column, or shows that there is none
+
+        The conditions are gathered into:
+            a bounding interval (from gt, gte, lt, lte and between=True),
+            a list of excluded closed intervals (from between=False, and from
+                eq=False, neq=True and in=False as single points),
+            an optional set of allowed values (from eq=True, neq=False and in=True).
+        Solving sorts and merges the excluded intervals and walks the gaps they leave
+        inside the bounding interval, so it takes O(k log k) for k conditions.
+        colType is 'integer', 'real' or 'text'. Text is ordered as python (and sqlite)
+        compare strings.
+    """
+    def __init__(self,colType):
+        if colType not in ['integer','real','text']:
+            print(f"ERROR: constraintSolver: unknown column type {colType}")
+            quit()
+        self.colType = colType
+        # None for lo or hi means unbounded
+        self.lo = None
+        self.loIncl = False
+        self.hi = None
+        self.hiIncl = False
+        self.excluded = []
+        self.allowed = None
+
+    def add(self,operation,operands,result):
+        ''' Adds the condition `operation` with `operands`, for which we want `result` '''
+        if ((operation == 'eq' and result is True) or
+            (operation == 'neq' and result is False)):
+            self._allow([operands[0]])
+        elif ((operation == 'eq' and result is False) or
+            (operation == 'neq' and result is True)):
+            self.excluded.append((operands[0],operands[0]))
+        elif ((operation == 'gt' and result is True) or
+            (operation == 'lte' and result is False)):
+            self._raiseLo(operands[0],False)
+        elif ((operation == 'gt' and result is False) or
+            (operation == 'lte' and result is True)):
+            self._lowerHi(operands[0],True)
+        elif ((operation == 'lt' and result is True) or
+            (operation == 'gte' and result is False)):
+            self._lowerHi(operands[0],False)
+        elif ((operation == 'lt' and result is False) or
+            (operation == 'gte' and result is True)):
+            self._raiseLo(operands[0],True)
+        elif (operation == 'between' and result is True):
+            self._raiseLo(operands[0],True)
+            self._lowerHi(operands[1],True)
+        elif (operation == 'between' and result is False):
+            self.excluded.append((operands[0],operands[1]))
+        elif (operation == 'in' and result is True):
+            self._allow(whereEvaluator.inList(operands[0]))
+        elif (operation == 'in' and result is False):
+            for value in whereEvaluator.inList(operands[0]):
+                self.excluded.append((value,value))
+        else:
+            print(f"ERROR: constraintSolver.add: no matching branch {operation}, {operands}, {result}")
+            quit()
+
+    def solve(self):
+        ''' Returns (True, value) for a value that satisfies every condition, or
+            (False, None) if no value can
+        '''
+        excluded = self._mergeExcluded()
+        if self.allowed is not None:
+            for value in sorted(self.allowed):
+                if self._inBounds(value) and not self._isExcluded(value,excluded):
+                    return True,value
+            return False,None
+        # Walk the gaps between the excluded intervals, from the bottom up
+        lo,loIncl = self.lo,self.loIncl
+        for exLo,exHi in excluded:
+            if lo is not None and exHi < lo:
+                continue
+            gapHi,gapHiIncl = self._minBound((exLo,False),(self.hi,self.hiIncl))
+            value = self._pickBetween(lo,loIncl,gapHi,gapHiIncl)
+            if value is not None:
+                return True,value
+            if self.hi is not None and exHi >= self.hi:
+                return False,None
+            lo,loIncl = exHi,False
+        value = self._pickBetween(lo,loIncl,self.hi,self.hiIncl)
+        if value is None:
+            return False,None
+        return True,value
+
+    def _allow(self,values):
+        if self.allowed is None:
+            self.allowed = set(values)
+        else:
+            self.allowed &= set(values)
+
+    def _raiseLo(self,value,incl):
+        if self.lo is None or value > self.lo or (value == self.lo and not incl):
+            self.lo,self.loIncl = value,incl
+
+    def _lowerHi(self,value,incl):
+        if self.hi is None or value < self.hi or (value == self.hi and not incl):
+            self.hi,self.hiIncl = value,incl
+
+    def _minBound(self,a,b):
+        ''' The lower of two upper bounds (value, inclusive) '''
+        if a[0] is None:
+            return b
+        if b[0] is None:
+            return a
+        if a[0] < b[0] or (a[0] == b[0] and not a[1]):
+            return a
+        return b
+
+    def _mergeExcluded(self):
+        ''' Sorts the excluded intervals and merges the ones that overlap '''
+        merged = []
+        for exLo,exHi in sorted(self.excluded):
+            if exLo > exHi:
+                # between with its operands reversed matches nothing, so excludes nothing
+                continue
+            if len(merged) > 0 and exLo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0],max(merged[-1][1],exHi))
+            else:
+                merged.append((exLo,exHi))
+        return merged
+
+    def _isExcluded(self,value,excluded):
+        i = bisect.bisect_right(excluded,(value,value)) - 1
+        # excluded is sorted by low end, so only the interval starting at or before
+        # value (or the next one, for a point equal to its low end) can hold value
+        for j in [i,i+1]:
+            if 0 <= j < len(excluded) and excluded[j][0] <= value <= excluded[j][1]:
+                return True
+        return False
+
+    def _inBounds(self,value):
+        if self.lo is not None and (value < self.lo or (value == self.lo and not self.loIncl)):
+            return False
+        if self.hi is not None and (value > self.hi or (value == self.hi and not self.hiIncl)):
+            return False
+        return True
+
+    def _pickBetween(self,lo,loIncl,hi,hiIncl):
+        ''' Returns a value of the column type in the given interval, or None if the
+            interval holds no such value. Values next to a bound are preferred.
+        '''
+        if self.colType == 'integer':
+            return self._pickInteger(lo,loIncl,hi,hiIncl)
+        if self.colType == 'real':
+            return self._pickReal(lo,loIncl,hi,hiIncl)
+        return self._pickText(lo,loIncl,hi,hiIncl)
+
+    def _pickInteger(self,lo,loIncl,hi,hiIncl):
+        loInt = None if lo is None else (math.ceil(lo) if loIncl else math.floor(lo) + 1)
+        hiInt = None if hi is None else (math.floor(hi) if hiIncl else math.ceil(hi) - 1)
+        if loInt is None and hiInt is None:
+            return 0
+        if loInt is None:
+            return hiInt
+        if hiInt is None or loInt <= hiInt:
+            return loInt
+        return None
+
+    def _pickReal(self,lo,loIncl,hi,hiIncl):
+        if lo is None and hi is None:
+            return 0.0
+        if lo is None:
+            return hi if hiIncl else hi - 1
+        if hi is None:
+            return lo if loIncl else lo + 1
+        if lo > hi or (lo == hi and not (loIncl and hiIncl)):
+            return None
+        if loIncl:
+            return lo
+        if hiIncl and lo + 1 >= hi:
+            return hi
+        if lo + 1 < hi:
+            return lo + 1
+        value = (lo + hi) / 2
+        if lo < value < hi:
+            return value
+        value = math.nextafter(lo,hi)
+        if value < hi:
+            return value
+        return None
+
+    def _pickText(self,lo,loIncl,hi,hiIncl):
+        if lo is None and hi is None:
+            return 'a'
+        if lo is None:
+            if hiIncl:
+                return hi
+            if hi == '':
+                return None
+            if 'AA' < hi:
+                return 'AA'
+            # Lowering the last character makes a string that sorts just below hi
+            if ord(hi[-1]) > 0:
+                return hi[:-1] + chr(ord(hi[-1]) - 1)
+            return hi[:-1]
+        if hi is not None and (lo > hi or (lo == hi and not (loIncl and hiIncl))):
+            return None
+        if loIncl:
+            return lo
+        # Any string that starts with lo and is longer sorts after lo
+        value = lo + 'a'
+        if hi is None or value < hi or (value == hi and hiIncl):
+            return value
+        # lo is excluded, so lo < hi here
+        if hiIncl:
+            return hi
+        # Here hi is lo followed by something that sorts at or below 'a', so pick a
+        # suffix that sorts below that something
+        below = self._pickText(None,False,hi[len(lo):],False)
+        if below is None or below == '':
+            return None
+        return lo + below
+
+if __name__ == "__main__":
+    pp = pprint.PrettyPrinter(indent=4)
+    tests = [
+        ('integer',[('gt',[5],True),('lt',[7],True)]),
+        ('integer',[('gt',[5],True),('lt',[6],True)]),
+        ('integer',[('in',[[1,2,3]],True),('neq',[1],True),('gt',[1],True)]),
+        ('integer',[('between',[1,10],False),('between',[-5,0],False),('gte',[-5],True),('eq',[11],False)]),
+        ('real',[('gt',[1.1],True),('lt',[1.2],True),('neq',[1.15],True)]),
+        ('text',[('gt',['a'],True),('lt',['aa'],True)]),
+        ('text',[('gt',['m'],False),('eq',['y'],False),('in',[['a','b']],False)]),
+        ('text',[('eq',['y'],True),('in',[['a','b']],True)]),
+    ]
+    for colType,conditions in tests:
+        solver = constraintSolver(colType)
+        for operation,operands,result in conditions:
+            solver.add(operation,operands,result)
+        print(f"{colType} {conditions}:")
+        pp.pprint(solver.solve())
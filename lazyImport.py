@@ -0,0 +1,29 @@
+import sys
+import importlib.util
+
+def lazyImport(name):
+    ''' Returns the module `name` without running it. The module is really imported
+        the first time one of its attributes is used, so that heavy modules (pandas,
+        numpy, moz_sql_parser) cost nothing for code paths that never touch them.
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        print(f"ERROR: lazyImport: no module named {name}")
+        quit()
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+if __name__ == "__main__":
+    import time
+    start = time.perf_counter()
+    pd = lazyImport('pandas')
+    print(f"lazyImport('pandas'): {time.perf_counter() - start:.4f}s")
+    start = time.perf_counter()
+    pd.DataFrame()
+    print(f"first use of pandas: {time.perf_counter() - start:.4f}s")
@@ -0,0 +1,96 @@
+import json
+import time
+import contextlib
+
+class phaseProfiler:
+    """ Collects the time spent in each phase of a run, and counts of the work done
+
+        A phase is timed with `with profiler.time('rows'):`, and can be entered
+        many times. A counter is added to with profiler.count('rowsEmitted',n).
+        getReport() gives, per phase, the seconds spent in it and the number of
+        times it was entered, and the value of each counter. Phases are not
+        exclusive: a phase entered inside another counts in both.
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counts = {}
+
+    def __bool__(self):
+        return True
+
+    @contextlib.contextmanager
+    def time(self,phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] = self.seconds.get(phase,0.0) + time.perf_counter() - start
+            self.calls[phase] = self.calls.get(phase,0) + 1
+
+    def count(self,counter,n=1):
+        self.counts[counter] = self.counts.get(counter,0) + n
+
+    def merge(self,report):
+        ''' Adds in a report from getReport() of another profiler (say, one that ran
+            in a worker process)
+        '''
+        for phase,entry in report['phases'].items():
+            self.seconds[phase] = self.seconds.get(phase,0.0) + entry['seconds']
+            self.calls[phase] = self.calls.get(phase,0) + entry['calls']
+        for counter,n in report['counts'].items():
+            self.count(counter,n)
+
+    def getReport(self):
+        return {'phases':{phase:{'seconds':self.seconds[phase],'calls':self.calls[phase]}
+                          for phase in self.seconds},
+                'counts':dict(self.counts)}
+
+    def toJson(self,path=None):
+        ''' Returns the report as json text, and writes it to path if given '''
+        text = json.dumps(self.getReport(),indent=2)
+        if path is not None:
+            with open(path,'w') as f:
+                f.write(text)
+        return text
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counts = {}
+
+class nullProfiler:
+    """ A phaseProfiler that records nothing, used when profiling is off. time()
+        hands back one shared do-nothing context, so a timed phase costs about a
+        method call. It is false, so that work done only for the profiler can be
+        skipped with `if profiler:`.
+    """
+    nullContext = contextlib.nullcontext()
+
+    def __bool__(self):
+        return False
+
+    def time(self,phase):
+        return self.nullContext
+
+    def count(self,counter,n=1):
+        pass
+
+    def merge(self,report):
+        pass
+
+    def getReport(self):
+        return {'phases':{},'counts':{}}
+
+    def toJson(self,path=None):
+        text = json.dumps(self.getReport(),indent=2)
+        if path is not None:
+            with open(path,'w') as f:
+                f.write(text)
+        return text
+
+    def reset(self):
+        pass
+
+# The profiler of everything that isn't given one
+disabled = nullProfiler()
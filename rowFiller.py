@@ -2,23 +2,283 @@ import sqlite3
 import pprint
 import os.path
 import itertools
-import random
-import string
-import pandas as pd
-import numpy as np
+import queue
+import threading
+import collections
+import concurrent.futures
+import lazyImport
 import whereParser
+import whereEvaluator
+import constraintSolver
+import tableSinks
+import tableCache
+import phaseProfiler
+
+# pandas and numpy are only loaded when rows are first made
+pd = lazyImport.lazyImport('pandas')
+np = lazyImport.lazyImport('numpy')
+
+# Part of the key of every table cache entry. Bump it whenever a change makes the
+# generated tables differ, so that stale entries are no longer found.
+generatorVersion = 5
 
 class aidManager:
-    """ Assigns the next aid value """
-    def __init__(self,alg='distinctPerRow'):
+    """ Assigns aid values to rows
+
+        alg is one of:
+            'distinctPerRow': every row gets its own aid
+            'kRowsPerAid': consecutive rows share an aid, k rows per aid
+            'zipf': consecutive rows share an aid, where the number of rows per aid
+                is drawn from a Zipf distribution with parameter a (capped at
+                maxRowsPerAid)
+            'sharedAcrossCombinations': a pool of numAids aids is reserved up front,
+                and the i-th row of every combination gets the (i mod numAids)-th
+                aid of the pool, so the same aids appear in many combinations
+        Aids are always taken from one contiguous range starting at 0 (see reserve()).
+        The aids of a run of rows don't depend on how the run is cut into batches.
+    """
+    # zipf counts are drawn this many at a time
+    zipfBlock = 1024
+
+    def __init__(self,alg='distinctPerRow',k=2,a=2.0,maxRowsPerAid=1000,numAids=10,seed=0):
         self.alg = alg
-        if self.alg == 'distinctPerRow':
-            self.nextVal = -1
+        self.nextVal = -1       # the last aid value reserved
+        # For the algorithms where consecutive rows share an aid, the current aid
+        # and the number of rows it still has to take
+        self.carryAid = None
+        self.carryRows = 0
+        if self.alg == 'kRowsPerAid':
+            self.k = k
+        elif self.alg == 'zipf':
+            self.a = a
+            self.maxRowsPerAid = maxRowsPerAid
+            self.rng = np.random.default_rng(seed)
+            # Counts drawn but not yet used. Drawing in blocks of zipfBlock, and
+            # keeping what a batch doesn't use for the next one, means the stream
+            # of counts is the same however the rows are batched.
+            self.zipfCounts = np.empty(0,dtype=np.int64)
+        elif self.alg == 'sharedAcrossCombinations':
+            self.pool = self.reserve(numAids)
+        elif self.alg != 'distinctPerRow':
+            print(f"ERROR: aidManager: unknown alg {alg}")
+            quit()
+
+    def reserve(self,numAids):
+        ''' Reserves a contiguous range of numAids new aid values and returns it as
+            a numpy array
+        '''
+        aids = np.arange(self.nextVal+1,self.nextVal+1+numAids,dtype=np.int64)
+        self.nextVal += numAids
+        return aids
 
     def nextAid(self):
+        return int(self.nextAids(1)[0])
+
+    def nextAids(self,numRows,offset=0):
+        ''' Returns the aids for the next batch of numRows rows as one numpy array.
+            A batch is all of the rows of one combination, or (when streaming) a run of
+            them starting at row `offset` of the combination.
+        '''
         if self.alg == 'distinctPerRow':
-            self.nextVal += 1
-            return self.nextVal
+            return self.reserve(numRows)
+        if self.alg == 'kRowsPerAid':
+            return self._spreadRows(numRows,self._kCounts)
+        if self.alg == 'zipf':
+            return self._spreadRows(numRows,self._zipfCounts)
+        if self.alg == 'sharedAcrossCombinations':
+            return self.pool[(np.arange(numRows) + offset) % len(self.pool)]
+
+    def nextAidsForBatches(self,counts,offsets=None):
+        ''' Returns the aids for consecutive batches of counts[i] rows as one numpy
+            array, the same as calling nextAids(counts[i],offsets[i]) once per batch
+        '''
+        if offsets is None:
+            offsets = np.zeros(len(counts),dtype=np.int64)
+        total = int(np.sum(counts))
+        if self.alg in ['distinctPerRow','kRowsPerAid']:
+            # These carry on from one batch to the next as if it were one batch
+            return self.nextAids(total)
+        if self.alg == 'sharedAcrossCombinations':
+            starts = np.cumsum(counts) - counts
+            rows = np.arange(total) - np.repeat(starts - offsets,counts)
+            return self.pool[rows % len(self.pool)]
+        aids = [np.empty(0,dtype=np.int64)]
+        for count,offset in zip(counts,offsets):
+            aids.append(self.nextAids(int(count),int(offset)))
+        return np.concatenate(aids)
+
+    def _spreadRows(self,numRows,drawCounts):
+        ''' Fills numRows rows, first with the rows the current aid still has to take,
+            and then with new aids whose rows-per-aid come from drawCounts
+        '''
+        parts = []
+        if self.carryRows > 0:
+            numCarried = min(self.carryRows,numRows)
+            parts.append(np.full(numCarried,self.carryAid,dtype=np.int64))
+            self.carryRows -= numCarried
+            numRows -= numCarried
+        if numRows > 0:
+            counts = drawCounts(numRows)
+            newAids = np.repeat(self.reserve(len(counts)),counts)
+            parts.append(newAids[:numRows])
+            self.carryAid = newAids[-1]
+            self.carryRows = len(newAids) - numRows
+        if len(parts) == 0:
+            return np.empty(0,dtype=np.int64)
+        return np.concatenate(parts)
+
+    def _kCounts(self,numRows):
+        return np.full(-(-numRows // self.k),self.k)
+
+    def _zipfCounts(self,numRows):
+        ''' Takes the next rows-per-aid counts from the stream of drawn counts, as
+            many as are needed to cover numRows rows
+        '''
+        draws = [self.zipfCounts]
+        total = int(self.zipfCounts.sum())
+        while total < numRows:
+            draw = np.minimum(self.rng.zipf(self.a,size=self.zipfBlock),self.maxRowsPerAid)
+            draws.append(draw)
+            total += int(draw.sum())
+        counts = np.concatenate(draws)
+        numAids = int(np.searchsorted(np.cumsum(counts),numRows)) + 1
+        self.zipfCounts = counts[numAids:]
+        return counts[:numAids]
+
+
+class valueAllocator:
+    """ Hands out new values for one column, guaranteed to differ from every value
+        the column has held
+
+        The allocator is seeded once from the column's values, when the table is
+        made (before anything can be stripped from it). Integers and reals
+        count up from the column maximum. Text values are the column maximum followed
+        by a counter encoded in lowercase letters, so they sort after every value
+        seen so far. Because the allocator is never re-seeded, removing rows from the
+        table does not cause values to be handed out again.
+    """
+    def __init__(self,values,colType):
+        self.colType = colType
+        if self.colType == 'text':
+            self.prefix = max(values) if len(values) > 0 else ''
+            self.maxSeen = self.prefix
+            self.counter = 0
+        else:
+            self.nextVal = 0
+            if len(values) > 0:
+                # As a python number, so that a narrow column dtype can't overflow
+                maxVal = values.max()
+                self.nextVal = (int(maxVal) if self.colType == 'integer' else float(maxVal)) + 1
+
+    def observe(self,values):
+        ''' Tells the allocator about values that were put in the column by
+            other means, so that they are never handed out
+        '''
+        if len(values) == 0:
+            return
+        if self.colType == 'text':
+            maxVal = max(values)
+            if maxVal >= self.prefix:
+                # maxVal could collide with a value we'd hand out, so restart from
+                # a prefix that is at least as big as every value seen so far
+                self.prefix = max(self.maxSeen,maxVal)
+                self.maxSeen = self.prefix
+                self.counter = 0
+        else:
+            self.nextVal = max(self.nextVal,max(values) + 1)
+
+    def allocate(self,numValues):
+        ''' Returns numValues new values as a numpy array '''
+        if self.colType != 'text':
+            values = self.nextVal + np.arange(numValues)
+            self.nextVal += numValues
+            return values
+        counters = np.arange(self.counter,self.counter+numValues)
+        self.counter += numValues
+        if numValues == 0:
+            return np.empty(0,dtype=object)
+        # Base 26 digits of the counters, most significant first. All counters in
+        # a batch get the same number of digits, so they are all distinct
+        width = 1
+        while 26 ** width <= counters[-1]:
+            width += 1
+        powers = 26 ** np.arange(width-1,-1,-1)
+        letters = ((counters[:,None] // powers) % 26 + ord('a')).astype(np.uint8)
+        suffixes = letters.view(f'S{width}').ravel().astype(str)
+        values = np.char.add(self.prefix,suffixes).astype(object)
+        self.maxSeen = max(self.maxSeen,max(values))
+        return values
+
+
+class connectionPool:
+    """ A thread-safe pool of read-only sqlite connections to one db file
+
+        Connections are reused, so each keeps its cache of prepared statements
+        across queries. At most maxConnections are opened. A caller that finds
+        them all in use waits for one to be released. If uri is given, connections
+        are made to it instead of to dbPath (this is how an in-memory db is shared).
+    """
+    def __init__(self,dbPath,maxConnections=4,cachedStatements=256,uri=None):
+        self.dbPath = dbPath
+        self.uri = uri
+        self.maxConnections = maxConnections
+        self.cachedStatements = cachedStatements
+        self.idle = queue.LifoQueue()
+        self.numConnections = 0
+        self.lock = threading.Lock()
+
+    def query(self,sql,params=()):
+        conn = self.acquire()
+        try:
+            return conn.execute(sql,params).fetchall()
+        finally:
+            self.release(conn)
+
+    def queryBatch(self,sqls,params=None):
+        ''' Runs each sql in sqls (with the matching entry of params, if given) on one
+            connection and returns the list of answers
+        '''
+        if params is None:
+            params = [()] * len(sqls)
+        conn = self.acquire()
+        try:
+            return [conn.execute(sqls[i],params[i]).fetchall() for i in range(len(sqls))]
+        finally:
+            self.release(conn)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.numConnections < self.maxConnections:
+                self.numConnections += 1
+                return self._connect()
+        return self.idle.get()
+
+    def release(self,conn):
+        self.idle.put(conn)
+
+    def close(self):
+        ''' Closes the idle connections. Connections still in use are closed when
+            they are garbage collected.
+        '''
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self.numConnections = 0
+
+    def _connect(self):
+        if self.uri is not None:
+            return sqlite3.connect(self.uri,uri=True,check_same_thread=False,
+                                   cached_statements=self.cachedStatements)
+        import urllib.request
+        uri = 'file:' + urllib.request.pathname2url(os.path.abspath(self.dbPath)) + '?mode=ro'
+        return sqlite3.connect(uri,uri=True,check_same_thread=False,
+                               cached_statements=self.cachedStatements)
 
 
 class rowFiller:
@@ -29,30 +289,133 @@ class rowFiller:
             useTestDbName=True,
             printIntermediateTables=True,
             numRowsPerCombination=10,
+            factorColumns=True,
+            coverage='all',
+            valueSolver='hybrid',
+            chunkRows=65536,
+            numWorkers=1,
+            dbPath=None,
+            dbCache=None,
+            compactDtypes=True,
+            maxRows=None,
+            maxBytes=None,
+            profiler=None,
             dop=False):
         self.pp = pprint.PrettyPrinter(indent=4)
+        # dop prints the conditions and budget of each table. For where the time
+        # goes, give a phaseProfiler: it times the phases of generation ('candidates',
+        # 'workingValues', 'rows', 'dataFrame', 'dbWrite') and counts the combinations
+        # tried and failed, the candidates evaluated and the rows emitted.
         self.dop = dop
+        self.profiler = phaseProfiler.disabled if profiler is None else profiler
         self.sw = sw
         self.printIntermediateTables = printIntermediateTables
         self.useTestDbName = useTestDbName
         self.aidSpec = aidSpec
         self.aidManagers = []
-        self.aidDummies = []
         self.aidCols = []
         self._makeAidColumns()
         for i in range(len(self.aidSpec)):
-            self.aidManagers.append(aidManager(self.aidSpec[i]))
-            self.aidDummies.append('x')
+            # Each aidSpec entry is either the aidManager alg name, or a dict of
+            # aidManager parameters like {'alg':'kRowsPerAid','k':5}
+            if type(self.aidSpec[i]) is dict:
+                self.aidManagers.append(aidManager(**self.aidSpec[i]))
+            else:
+                self.aidManagers.append(aidManager(self.aidSpec[i]))
         self.numRowsPerCombination = numRowsPerCombination
+        # When factorColumns is True, the working values for each column are solved
+        # once per truth assignment of that column's own conditions, and then reused
+        # across all combinations that share that assignment
+        self.factorColumns = factorColumns
+        self.columnCache = {}
+        # The numpy dtype of each table's columns, per table, from _prepareColumns()
+        self.columnDtypes = {}
+        # coverage is 'all' (every True/False combination of the conditions) or 'mcdc'
+        # (only the combination pairs that show each condition flipping the WHERE clause)
+        if coverage not in ['all','mcdc']:
+            print(f"ERROR: rowFiller: unknown coverage {coverage}")
+            quit()
+        self.coverage = coverage
+        self.coverageReport = {}
+        # valueSolver says how working values are found for a column:
+        #   'candidates': try the candidate values proposed by each condition
+        #   'interval': solve the column's conditions with constraintSolver, giving
+        #       one value (or proving there is none)
+        #   'hybrid': try the candidates, and use constraintSolver when none work
+        if valueSolver not in ['candidates','interval','hybrid']:
+            print(f"ERROR: rowFiller: unknown valueSolver {valueSolver}")
+            quit()
+        self.valueSolver = valueSolver
+        # The number of rows per chunk when streaming with streamBaseTables()
+        self.chunkRows = chunkRows
+        # With numWorkers > 1 the combinations are split into shards that a pool of
+        # worker processes solve and make rows for. The aids are still handed out
+        # here, in combination order, so the rows are the same as with one worker.
+        self.numWorkers = numWorkers
+        # When compactDtypes is True, baseDf holds text as categoricals, aids and
+        # integers in the narrowest int dtype that fits them, and reals as float32
+        # where that loses nothing
+        self.compactDtypes = compactDtypes
+        # The budget for each table: at most maxRows rows, and at most maxBytes bytes of
+        # memory (as estimated by estimate()) to make it. A table over budget is made
+        # with fewer rows per combination, down to one, and then from an evenly spaced
+        # sample of the working combinations. sample is (number kept, out of, the column
+        # assignments they are made of), or None when every combination is made.
+        # budgetReport says what was cut, per table.
+        self.maxRows = maxRows
+        self.maxBytes = maxBytes
+        self.requestedRowsPerCombination = numRowsPerCombination
+        self.sample = None
+        self.budgetReport = {}
+        # The hash of everything that decides the generated tables
+        self.contentKey = self._makeContentKey()
+        # dbCache is an optional tableCache.tableCache. makeBaseTables() then takes the
+        # tables (db and baseDf) from the cache when they are there, and
+        # baseTablesToDb() stores them when they weren't. cacheKey is the key to
+        # store under, cleared once baseDf is changed. dbFromCache says the db was
+        # copied from the cache.
+        self.dbCache = dbCache
+        self.cacheKey = None
+        self.dbFromCache = False
         self.maxDbName = 50
         self.dbName = self._makeDbName()
-        self.dbPath = os.path.join('tables',self.dbName)
+        # dbPath defaults to tables/<dbName>. ':memory:' keeps the db in memory, shared
+        # by this rowFiller's connections through a uri that no other rowFiller uses.
+        # The in-memory db lasts until closeDb().
+        if dbPath is None:
+            dbPath = os.path.join('tables',self.dbName)
+        self.dbPath = dbPath
+        self.dbUri = None
+        if dbPath == ':memory:':
+            self.dbUri = f"file:rowFiller{os.getpid()}_{id(self)}?mode=memory&cache=shared"
         self.failedCombinations = []
         self.allColumns = []
         self.newRows = []
-        # This will be one list per table
+        # This will be one list per table. Each list entry is a chunk of rows held
+        # as a dict of column name to numpy array
         self.baseData = {}
         self.baseDf = {}
+        # Rows appended to or shifted into baseDf are buffered here (one list of
+        # dataframes per table), and concatenated in one go by flushDf()
+        self.pendingRows = {}
+        # The index label for the next row appended to each table
+        self.nextRowId = {}
+        # One valueAllocator per table and column, seeded when the table's baseDf is made
+        self.valueAllocators = {}
+        # The sql db is kept in step with baseDf incrementally. dbTables holds the
+        # tables already written to the db, and dbInserted/dbDeleted hold (per table)
+        # the index labels of the rows added to or removed from baseDf since the last
+        # sync. The dataframe index label is stored in the db as column "index".
+        # Every write to the db goes through dbSink, a tableSinks.sqliteSink.
+        self.dbSink = None
+        # Read-only connections used by queryDb(), made on first use
+        self.readPool = None
+        # Compiled whereEvaluators used by queryMem(), keyed by sql string
+        self.evaluators = {}
+        self.dbPageSize = 32768
+        self.dbTables = set()
+        self.dbInserted = {}
+        self.dbDeleted = {}
 
     def getDbName(self):
         return self.dbName
@@ -60,17 +423,62 @@ class rowFiller:
     def getDbPath(self):
         return self.dbPath
 
-    def queryDb(self,sql):
-        self.conn = sqlite3.connect(self.dbPath)
-        self.cur = self.conn.cursor()
-        self.cur.execute(sql)
-        answer = self.cur.fetchall()
-        self.conn.close()
-        return answer
+    def queryDb(self,sql,params=()):
+        self.flushDf()
+        return self._getReadPool().query(sql,params)
+
+    def queryDbBatch(self,sqls,params=None):
+        ''' Runs a list of sql queries (optionally with a list of parameter tuples)
+            and returns the list of answers
+        '''
+        self.flushDf()
+        return self._getReadPool().queryBatch(sqls,params)
+
+    def queryMem(self,sql):
+        ''' Answers a count query (as queryDb() would) directly from baseDf, without
+            going through sqlite
+        '''
+        if sql not in self.evaluators:
+            self.evaluators[sql] = whereEvaluator.whereEvaluator(whereParser.simpleWhere(sql))
+        evaluator = self.evaluators[sql]
+        self.flushDf(evaluator.table)
+        return evaluator.count(self.baseDf[evaluator.table])
+
+    def _getReadPool(self):
+        if self.readPool is None:
+            self.readPool = connectionPool(self.dbPath,uri=self.dbUri)
+        return self.readPool
 
     def queryDf(self,table,query):
-        df = self.baseDf[table].query(query)
-        return df
+        self.flushDf(table)
+        df = self.baseDf[table]
+        return df[self._queryMask(df,query)]
+
+    def _queryMask(self,df,query):
+        ''' Returns the boolean mask of the rows of df that match the dataframe query '''
+        try:
+            return df.eval(query)
+        except TypeError:
+            # Pandas only compares categoricals for (in)equality, so order comparisons
+            # on text columns are done on plain object columns
+            expanded = {column:object for column in df.columns if df[column].dtype.name == 'category'}
+            return df.astype(expanded).eval(query)
+
+    def flushDf(self,table=None):
+        ''' Concatenates any buffered rows into baseDf, for one table or for all tables '''
+        tables = list(self.pendingRows.keys()) if table is None else [table]
+        for tab in tables:
+            if len(self.pendingRows.get(tab,[])) == 0:
+                continue
+            df = pd.concat([self.baseDf[tab]] + self.pendingRows[tab])
+            if self.compactDtypes:
+                # Columns whose new rows didn't fit the compact dtype (new categories,
+                # bigger ints) came out of concat widened, so compact them again
+                for column in df.columns:
+                    if df[column].dtype != self.baseDf[tab][column].dtype:
+                        df[column] = self._compactColumn(tab,column,df[column].to_numpy())
+            self.baseDf[tab] = df
+            self.pendingRows[tab] = []
 
     def _makeAidColumns(self):
         self.aidCols = []
@@ -80,33 +488,520 @@ class rowFiller:
     def getAidColumns(self):
         return self.aidCols
 
+    def getProfile(self):
+        ''' Returns the profiler's report (empty if there is no profiler) '''
+        return self.profiler.getReport()
+
+    def getCoverage(self,table):
+        ''' Returns the coverage achieved by makeBaseTables() for the table '''
+        return self.coverageReport[table]
+
+    def estimate(self):
+        ''' Returns, per table, what makeBaseTables() would make, worked out from the
+            conditions without making any rows:
+                'numCombinations': the combinations that would be tried
+                'numWorkingCombinations': those that would get rows
+                'numRowsPerCombination': after any cut to the budget
+                'numRows': rows in the table
+                'bytesPerRow', 'bytes': memory taken by the table in baseDf
+                'peakBytes': memory taken while makeBaseTables() makes it
+            The row counts are exact. The bytes are those of the column arrays.
+        '''
+        estimates = {}
+        for table in self.sw.iterTabs():
+            self._startTable(table)
+            self._applyBudget(table)
+            estimates[table] = self._estimateTable(table)
+        return estimates
+
     def makeBaseTables(self):
         ''' This builds the basic table that has as many matching combinations
             as possible. It also makes the base dataframe from the baseData
         '''
+        if self._loadFromCache(True):
+            return
+        self.cacheKey = self.contentKey
         for table in self.sw.iterTabs():
+            self._startTable(table)
+            self._applyBudget(table)
             self.baseData[table] = []
-            self.conditions = list(self.sw.iterConditions(table))
-            if self.dop:
-                print(f"Conditions (table {table}):")
-                self.pp.pprint(self.conditions)
-            self._processOneTable(table,self.baseData[table])
-            if self.printIntermediateTables:
-                self.pp.pprint(self.baseData[table])
+            if self.numWorkers > 1:
+                for chunk in self._iterShardChunks(table):
+                    self.baseData[table].append(chunk)
+                continue
+            for values in self._processOneTable(table):
+                self.baseData[table].append(self._makeRows(table,values))
         for table,data in self.baseData.items():
-            self.allColumns = []
-            for aidCol in self.aidCols:
-                self.allColumns.append(aidCol)
-            for column in list(self.sw.iterCols(table)):
-                self.allColumns.append(column)
-            self.baseDf[table] = pd.DataFrame(data, columns=self.allColumns) 
+            self._makeBaseDf(table,data)
+
+    def streamBaseTables(self,sink=None,makeDf=False):
+        ''' Does the work of makeBaseTables() and baseTablesToDb() in one pass. Rows go
+            to the sink in chunks of chunkRows rows as they are made, so memory use is
+            bounded by the chunk size rather than by the table size. The sink defaults
+            to a tableSinks.sqliteSink on this rowFiller's db. baseDf (which holds the
+            whole table) is only made if makeDf is True.
+        '''
+        ownSink = sink is None
+        if ownSink and self._loadFromCache(makeDf):
+            return
+        if ownSink:
+            self.closeDb()
+            if os.path.exists(self.dbPath):
+                os.remove(self.dbPath)
+            self.dbTables = set()
+            sink = self._getDbSink()
+        for table in self.sw.iterTabs():
+            self._startTable(table)
+            self._applyBudget(table)
+            columns = self.aidCols + list(self.sw.iterCols(table))
+            with self.profiler.time('dbWrite'):
+                sink.begin(table,columns,self._getColTypes(table,columns))
+            data = []
+            numRows = 0
+            for chunk in self._iterRowChunks(table):
+                numChunkRows = len(chunk[columns[0]])
+                with self.profiler.time('dbWrite'):
+                    sink.write(table,np.arange(numRows,numRows+numChunkRows),chunk)
+                numRows += numChunkRows
+                if makeDf:
+                    data.append(chunk)
+            with self.profiler.time('dbWrite'):
+                sink.end(table)
+            if makeDf:
+                self._makeBaseDf(table,data)
+                if ownSink:
+                    # The db already holds exactly the rows of baseDf
+                    self.dbTables.add(table)
+                    self.dbInserted[table] = []
+                    self.dbDeleted[table] = []
+        if ownSink and self.dbCache is not None:
+            self.dbCache.put(self.contentKey,sink.conn,self._makeCacheMetadata())
+
+    def exportTables(self,sink,tables=None):
+        ''' Writes baseDf tables (as generated, or as since stripped and appended to)
+            to a tableSinks sink, in chunks of chunkRows rows. Columns go to the sink
+            as whole arrays (categoricals as codes and categories), so only sinks that
+            work by rows, like sqliteSink and csvSink, convert row by row.
+        '''
+        self.flushDf()
+        tables = list(self.baseDf.keys()) if tables is None else tables
+        for table in tables:
+            df = self.baseDf[table]
+            columns = list(df.columns)
+            sink.begin(table,columns,self._getColTypes(table,columns))
+            self._writeDf(sink,table,df)
+            sink.end(table)
+
+    def _writeDf(self,sink,table,df):
+        ''' Writes the rows of df to the sink in chunks of chunkRows rows '''
+        rowIds = df.index.to_numpy()
+        for start in range(0,len(df),self.chunkRows):
+            stop = min(len(df),start + self.chunkRows)
+            chunk = {column:df[column].values[start:stop] for column in df.columns}
+            sink.write(table,rowIds[start:stop],chunk)
+
+    def _getColTypes(self,table,columns):
+        colTypes = {}
+        for column in columns:
+            colTypes[column] = 'integer' if column in self.aidCols else self.sw.getColType(table,column)
+        return colTypes
+
+    def _loadFromCache(self,makeDf):
+        ''' Copies the tables from dbCache into the db, and into baseDf if makeDf is
+            True. Returns False if they are not in the cache.
+        '''
+        if self.dbCache is None:
+            return False
+        self.closeDb()
+        if self.dbUri is None and os.path.exists(self.dbPath):
+            os.remove(self.dbPath)
+        conn = self._getWriteConn()
+        metadata = self.dbCache.get(self.contentKey,conn)
+        if metadata is None:
+            return False
+        self.failedCombinations = metadata['failedCombinations']
+        self.coverageReport = metadata['coverageReport']
+        self.budgetReport = metadata['budgetReport']
+        if makeDf:
+            for table in metadata['tables']:
+                if metadata['columns'] is not None:
+                    columns = metadata['columns'][table]
+                    df = pd.DataFrame(columns['data'],index=columns['index'],columns=list(columns['data']))
+                else:
+                    # The tables were streamed without a baseDf
+                    df = pd.read_sql(f'SELECT * FROM "{table}"',conn,index_col='index')
+                    df.index.name = None
+                    if self.compactDtypes:
+                        for column in df.columns:
+                            df[column] = self._compactColumn(table,column,df[column].to_numpy())
+                self.baseDf[table] = df
+                self.allColumns = list(df.columns)
+                self.pendingRows[table] = []
+                self.nextRowId[table] = len(df)
+                self._seedValueAllocators(table)
+                # The db already holds exactly the rows of baseDf
+                self.dbTables.add(table)
+                self.dbInserted[table] = []
+                self.dbDeleted[table] = []
+                if self.printIntermediateTables:
+                    self.pp.pprint(self.baseDf[table])
+        self.dbFromCache = True
+        return True
+
+    def _makeCacheMetadata(self):
+        ''' Besides the db, the cache keeps the failed combinations, the coverage and
+            (when there is a baseDf) the columns of baseDf, since reading those back
+            from the db takes longer than making them
+        '''
+        columns = None
+        if len(self.baseDf) > 0:
+            columns = {}
+            for table,df in self.baseDf.items():
+                columns[table] = {'index':df.index.to_numpy(),
+                                  'data':{column:df[column].values for column in df.columns}}
+        return {'tables':list(self.sw.iterTabs()),
+                'failedCombinations':self.failedCombinations,
+                'coverageReport':self.coverageReport,
+                'budgetReport':self.budgetReport,
+                'columns':columns}
+
+    def _makeContentKey(self):
+        return tableCache.makeKey({'sql':whereParser.normalizeSql(self.sw.sqlStr),
+                                   'aidSpec':self.aidSpec,
+                                   'numRowsPerCombination':self.numRowsPerCombination,
+                                   'coverage':self.coverage,
+                                   'valueSolver':self.valueSolver,
+                                   # The cache also keeps baseDf, whose dtypes this decides
+                                   'compactDtypes':self.compactDtypes,
+                                   'maxRows':self.maxRows,
+                                   'maxBytes':self.maxBytes,
+                                   'generatorVersion':generatorVersion})
+
+    def _startTable(self,table):
+        self.conditions = list(self.sw.iterConditions(table))
+        # conditionPredicates keyed by (condition position, wanted result), shared
+        # across all combinations of the table
+        self.predicates = {}
+        if self.dop:
+            print(f"Conditions (table {table}):")
+            self.pp.pprint(self.conditions)
+
+    def _estimateTable(self,table):
+        ''' The estimate() of one table, as it would be made now (after _startTable()) '''
+        columns = list(self.sw.iterCols(table))
+        self._prepareColumns(table,columns)
+        sizes = self._getColumnSizes(columns)
+        numCombinations,numWorkingCombinations,numProductRows = self._countCombinationRows(columns,sizes)
+        numRows = numProductRows * self.numRowsPerCombination
+        bytesPerRow = self._getBytesPerRow(table,columns,numRows)
+        return {'numCombinations':numCombinations,
+                'numWorkingCombinations':numWorkingCombinations,
+                'numRowsPerCombination':self.numRowsPerCombination,
+                'numRows':numRows,
+                'bytesPerRow':bytesPerRow,
+                'bytes':numRows * bytesPerRow,
+                'peakBytes':numRows * self._getPeakBytesPerRow(columns,bytesPerRow)}
+
+    def _getColumnSizes(self,columns):
+        ''' Returns, per column, the number of working values for each assignment of
+            the column's own conditions (0 when the assignment fails)
+        '''
+        sizes = {}
+        for column in columns:
+            numPositions = len(self.columnCache[column]['positions'])
+            sizes[column] = {}
+            for subComb in itertools.product([True,False],repeat=numPositions):
+                sizes[column][subComb] = len(self._getColumnValues(column,subComb)[0])
+        return sizes
+
+    def _countCombinationRows(self,columns,sizes):
+        ''' Returns the number of combinations, of working combinations, and of rows
+            with one row per combination
+        '''
+        if self.coverage == 'all' and self.sample is None:
+            # Each condition is on one column, so a combination is one assignment per
+            # column, and its rows are the product of its assignments' sizes. Summed
+            # over all combinations, that is the product of each column's summed sizes.
+            numWorkingCombinations = 1
+            numProductRows = 1
+            for column in columns:
+                numWorkingCombinations *= sum(1 for size in sizes[column].values() if size > 0)
+                numProductRows *= sum(sizes[column].values())
+            return 2 ** len(self.conditions),numWorkingCombinations,numProductRows
+        numCombinations = 0
+        numWorkingCombinations = 0
+        numProductRows = 0
+        for comb in self._getCombinations():
+            numCombinations += 1
+            numProduct = 1
+            for column in columns:
+                numProduct *= sizes[column][tuple(comb[i] for i in self.columnCache[column]['positions'])]
+            if numProduct > 0:
+                numWorkingCombinations += 1
+                numProductRows += numProduct
+        return numCombinations,numWorkingCombinations,numProductRows
+
+    def _getBytesPerRow(self,table,columns,numRows):
+        ''' Returns the bytes per row of baseDf, with each column in the dtype that
+            _compactColumn() would give it
+        '''
+        bytesPerRow = 0
+        for aidCol in self.aidCols:
+            # An aid is never bigger than the number of rows
+            bytesPerRow += self._getItemSize(table,aidCol,np.array([0,numRows]))
+        for column in columns:
+            values = []
+            for workingValueList,_,_ in self.columnCache[column]['solved'].values():
+                values += workingValueList
+            bytesPerRow += self._getItemSize(table,column,self._makeValueArray(table,column,values))
+        return bytesPerRow
+
+    def _getItemSize(self,table,column,values):
+        ''' Returns the bytes per row of a column that holds (only) `values` '''
+        if not self.compactDtypes or len(values) == 0:
+            # int64, float64, or a pointer to a python str
+            return 8
+        compacted = self._compactColumn(table,column,values)
+        if hasattr(compacted,'codes'):
+            return compacted.codes.itemsize
+        return compacted.dtype.itemsize
+
+    def _getPeakBytesPerRow(self,columns,bytesPerRow):
+        ''' makeBaseTables() keeps the row chunks (one 8-byte value per column). Making
+            baseDf from them takes about as much again in whole columns before they
+            are compacted, and holds baseDf's columns twice (once as arrays, and once
+            copied into the dataframe).
+        '''
+        return 16 * (len(self.aidCols) + len(columns)) + 2 * bytesPerRow
+
+    def _applyBudget(self,table):
+        ''' Cuts the table down to the budget, if there is one. First there are fewer rows
+            per combination. If one row per combination is still too many, the table
+            is made from an evenly spaced sample of the working combinations, the same
+            one every time. A combination's rows are the product of its columns' numbers
+            of values, so a few large assignments can leave room for very few of them:
+            while it lets more combinations in, the largest assignment of some column is
+            left out of the sample. If not even one combination fits, the table is left
+            empty, with a warning.
+        '''
+        self.numRowsPerCombination = self.requestedRowsPerCombination
+        self.sample = None
+        if self.maxRows is None and self.maxBytes is None:
+            return
+        estimate = self._estimateTable(table)
+        rowLimit = self._getRowLimit(estimate)
+        if estimate['numRows'] <= rowLimit:
+            return
+        numProductRows = estimate['numRows'] // self.numRowsPerCombination
+        numDropped = 0
+        if numProductRows <= rowLimit:
+            self.numRowsPerCombination = rowLimit // numProductRows
+        else:
+            self.numRowsPerCombination = 1
+            # The column cache still holds what _estimateTable() solved
+            columns = list(self.sw.iterCols(table))
+            sizes = self._getColumnSizes(columns)
+            assignments = {column:[subComb for subComb,size in sizes[column].items() if size > 0]
+                           for column in columns}
+            sample = self._fitSample(columns,sizes,assignments,rowLimit)
+            while True:
+                # The column whose largest assignment is furthest above its smallest
+                candidates = [column for column in columns if len(assignments[column]) > 1]
+                if len(candidates) == 0:
+                    break
+                columnSizes = {column:[sizes[column][subComb] for subComb in assignments[column]]
+                               for column in candidates}
+                column = max(candidates,key=lambda column: max(columnSizes[column]) / min(columnSizes[column]))
+                largest = max(assignments[column],key=lambda subComb: sizes[column][subComb])
+                fewer = dict(assignments)
+                fewer[column] = [subComb for subComb in assignments[column] if subComb != largest]
+                fewerSample = self._fitSample(columns,sizes,fewer,rowLimit)
+                if sample[0] > 0 and fewerSample[0] <= sample[0]:
+                    break
+                assignments = fewer
+                sample = fewerSample
+                numDropped += 1
+            self.sample = sample
+        self.budgetReport[table] = {'numRows':estimate['numRows'],
+                                    'rowLimit':rowLimit,
+                                    'numRowsPerCombination':self.numRowsPerCombination,
+                                    'sample':None if self.sample is None else self.sample[:2],
+                                    'numDroppedAssignments':numDropped}
+        if self.sample is not None and self.sample[0] == 0 and rowLimit > 0:
+            self.budgetReport[table]['empty'] = True
+            print(f"WARNING: no combination of table {table} fits the budget of {rowLimit} rows, so it is empty")
+        if self.dop:
+            print(f"Budget (table {table}):")
+            self.pp.pprint(self.budgetReport[table])
+
+    def _fitSample(self,columns,sizes,assignments,rowLimit):
+        ''' Returns the largest sample (keep, outOf, assignments) of the working
+            combinations made of `assignments` (the column assignments to sample from)
+            that fits in rowLimit rows, keep being 0 if none does
+        '''
+        if self.coverage == 'all':
+            numCombinations = 1
+            numProductRows = 1
+            for column in columns:
+                numCombinations *= len(assignments[column])
+                numProductRows *= sum(sizes[column][subComb] for subComb in assignments[column])
+        else:
+            numCombinations,numProductRows = 0,0
+            for comb in self._selectAssigned(self._getMcdcCombinations(),assignments):
+                numCombinations += 1
+                numProduct = 1
+                for column in columns:
+                    numProduct *= sizes[column][tuple(comb[i] for i in self.columnCache[column]['positions'])]
+                numProductRows += numProduct
+        if numCombinations == 0:
+            return (0,0,assignments)
+        keep = min(numCombinations,numCombinations * rowLimit // numProductRows)
+        while keep > 0:
+            self.sample = (keep,numCombinations,assignments)
+            numRows = self._countCombinationRows(columns,sizes)[2]
+            if numRows <= rowLimit:
+                break
+            keep = min(keep - 1,keep * rowLimit // numRows)
+        return (keep,numCombinations,assignments)
+
+    def _getRowLimit(self,estimate):
+        ''' Returns the most rows the budget allows for a table like `estimate` '''
+        limits = []
+        if self.maxRows is not None:
+            limits.append(self.maxRows)
+        if self.maxBytes is not None and estimate['numRows'] > 0:
+            limits.append(int(self.maxBytes * estimate['numRows'] // estimate['peakBytes']))
+        if len(limits) == 0:
+            return estimate['numRows']
+        return min(limits)
+
+    def _makeBaseDf(self,table,data):
+        ''' Makes the table's base dataframe from its list of row chunks '''
+        with self.profiler.time('dataFrame'):
+            self._makeBaseDfColumns(table,data)
+        if self.printIntermediateTables:
+            self.pp.pprint(self.baseDf[table])
+
+    def _makeBaseDfColumns(self,table,data):
+        self.allColumns = []
+        for aidCol in self.aidCols:
+            self.allColumns.append(aidCol)
+        for column in list(self.sw.iterCols(table)):
+            self.allColumns.append(column)
+        columnData = {}
+        for column in self.allColumns:
+            columnData[column] = self._concatChunks(table,column,data)
+            if self.compactDtypes:
+                columnData[column] = self._compactColumn(table,column,columnData[column])
+        self.baseDf[table] = pd.DataFrame(columnData, columns=self.allColumns)
+        self.pendingRows[table] = []
+        self.nextRowId[table] = len(self.baseDf[table])
+        self._seedValueAllocators(table)
     
+    def _compactColumn(self,table,column,values):
+        ''' Returns the numpy array `values` of the column in the smallest dtype that
+            holds them exactly
+        '''
+        if len(values) == 0:
+            return values
+        if column not in self.aidCols and self.sw.getColType(table,column) == 'text':
+            return pd.Categorical(values)
+        if values.dtype.kind in 'iu':
+            lo = values.min()
+            hi = values.max()
+            for dtype in [np.int8,np.int16,np.int32]:
+                if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+                    return values.astype(dtype)
+        elif values.dtype.kind == 'f':
+            # A real like 1.1 is not exact as float32, and would no longer match its
+            # condition, so only use float32 if every value comes back unchanged
+            compact = values.astype(np.float32)
+            if np.array_equal(compact.astype(values.dtype),values):
+                return compact
+        return values
+
     def baseTablesToDb(self):
-        ''' This takes the base table and writes it to an sql db '''
-        self.conn = sqlite3.connect(self.dbPath)
-        for table,df in self.baseDf.items():
-            df.to_sql(table,con=self.conn, if_exists='replace')
-        self.conn.close()
+        ''' This takes the base table and writes it to an sql db. The db is made from
+            scratch so that the page size pragma takes effect.
+        '''
+        if self.dbFromCache:
+            # makeBaseTables() copied the db from the cache, so only later changes
+            # to baseDf need writing
+            self.syncDb()
+            return
+        self.flushDf()
+        self.closeDb()
+        if os.path.exists(self.dbPath):
+            os.remove(self.dbPath)
+        self.dbTables = set()
+        for table in self.baseDf.keys():
+            self._loadTableToDb(table)
+        if self.dbCache is not None and self.cacheKey is not None:
+            self.dbCache.put(self.cacheKey,self._getWriteConn(),self._makeCacheMetadata())
+            self.cacheKey = None
+
+    def syncDb(self,table=None):
+        ''' Brings the sql db in step with baseDf, for one table or for all tables.
+            Tables not yet in the db are loaded whole. For the others, only the rows
+            inserted or deleted since the last sync are written, in one transaction.
+        '''
+        self.flushDf()
+        tables = list(self.baseDf.keys()) if table is None else [table]
+        sink = self._getDbSink()
+        for tab in tables:
+            if tab not in self.dbTables:
+                self._loadTableToDb(tab)
+                continue
+            inserted = np.concatenate([np.empty(0,dtype=np.int64)] + self.dbInserted[tab])
+            deleted = np.concatenate([np.empty(0,dtype=np.int64)] + self.dbDeleted[tab])
+            # A row inserted and then deleted between two syncs never reaches the db
+            insertIds = np.setdiff1d(inserted,deleted)
+            deleteIds = np.setdiff1d(deleted,inserted)
+            if tab not in sink.columns:
+                # The table came from the cache or an earlier sink
+                sink.resume(tab,list(self.baseDf[tab].columns))
+            with self.profiler.time('dbWrite'),sink.conn:
+                sink.delete(tab,deleteIds)
+                self._writeDf(sink,tab,self.baseDf[tab].loc[insertIds])
+            self.dbInserted[tab] = []
+            self.dbDeleted[tab] = []
+
+    def closeDb(self):
+        if self.dbSink is not None:
+            self.dbSink.close()
+            self.dbSink = None
+        if self.readPool is not None:
+            self.readPool.close()
+            self.readPool = None
+
+    def _getDbSink(self):
+        ''' The sqliteSink that all writes to the db go through, made on first use.
+            For an in-memory db, its connection is what keeps the db alive.
+        '''
+        if self.dbSink is None:
+            if self.dbUri is None:
+                self.dbSink = tableSinks.sqliteSink(self.dbPath,self.dbPageSize)
+            else:
+                self.dbSink = tableSinks.sqliteSink(self.dbUri,self.dbPageSize,uri=True)
+        return self.dbSink
+
+    def _getWriteConn(self):
+        return self._getDbSink().conn
+
+    def _loadTableToDb(self,table):
+        ''' Writes the whole table in one transaction, building the index only
+            after the rows are in
+        '''
+        df = self.baseDf[table]
+        columns = list(df.columns)
+        sink = self._getDbSink()
+        with self.profiler.time('dbWrite'):
+            sink.begin(table,columns,self._getColTypes(table,columns))
+            self._writeDf(sink,table,df)
+            sink.end(table)
+        self.dbTables.add(table)
+        self.dbInserted[table] = []
+        self.dbDeleted[table] = []
 
     def appendDf(self,table,spec):
         ''' This adds the rows defined by the spec to the base dataframe
@@ -118,24 +1013,31 @@ class rowFiller:
         for _,vals in spec.items():
             numRows = max(numRows,len(vals))
         for column in self.allColumns:
-            dfSpec[column] = []
+            dfSpec[column] = [None] * numRows
+            newPositions = []
+            givenValues = []
             for i in range(numRows):
                 if column not in spec or len(spec[column]) <= i or spec[column][i] == 'unique':
-                    dfSpec[column].append(self._getNewVal(table,column))
+                    newPositions.append(i)
                 else:
-                    dfSpec[column].append(spec[column][i])
-        df = pd.DataFrame(dfSpec)
+                    dfSpec[column][i] = spec[column][i]
+                    givenValues.append(spec[column][i])
+            allocator = self._getValueAllocator(table,column)
+            allocator.observe(givenValues)
+            newValues = allocator.allocate(len(newPositions))
+            for i in range(len(newPositions)):
+                dfSpec[column][newPositions[i]] = newValues[i]
+        rowIds = range(self.nextRowId[table],self.nextRowId[table]+numRows)
+        self.nextRowId[table] += numRows
+        df = pd.DataFrame(dfSpec,index=rowIds)
         self._addToNewRows(dfSpec)
-        self.baseDf[table] = self.baseDf[table].append(df)
+        self.pendingRows[table].append(df)
+        self._noteDbChange(self.dbInserted,table,df.index)
 
     def stripDf(self,table,query):
         ''' This removes the rows that match the dataframe query
         '''
-        bdf = self.baseDf[table]
-        notQuery = f"not({query})"
-        dfKeep = bdf.query(notQuery)
-        # dfKeep contains everything except what matches the query
-        self.baseDf[table] = dfKeep
+        self._stripRows(table,query,{})
     
     def iterNewRows(self):
         for newRow in self.newRows:
@@ -153,85 +1055,508 @@ class rowFiller:
                 newRow[col] = val[i]
             self.newRows.append(newRow)
 
-    def _getNewVal(self,table,column):
-        col = self.baseDf[table][column]
-        maxVal = col.max()
-        if type(maxVal) is str:
-            return ''.join(random.choice(string.ascii_lowercase) for _ in range(3))
-        elif np.issubdtype(maxVal,np.integer) or np.issubdtype(maxVal,np.float):
-            return maxVal + 1
-        else:
-            print(f"ERROR: _getNewVal: {table}, {column}, {maxVal}")
-            quit()
+    def _noteDbChange(self,changes,table,rowIds):
+        ''' Records inserted or deleted rows for the next syncDb() '''
+        # baseDf no longer holds just the generated tables, so must not be cached
+        self.cacheKey = None
+        if table not in changes:
+            changes[table] = []
+        changes[table].append(np.asarray(rowIds,dtype=np.int64))
+
+    def _seedValueAllocators(self,table):
+        ''' Seeds a valueAllocator for each column of the table's new baseDf, so that
+            the values of rows stripped later are never handed out again
+        '''
+        self.valueAllocators[table] = {}
+        for column in self.baseDf[table].columns:
+            self._getValueAllocator(table,column)
+
+    def _getValueAllocator(self,table,column):
+        ''' Returns the valueAllocator for the column, seeding it from the column's
+            current values (including buffered rows) the first time
+        '''
+        if table not in self.valueAllocators:
+            self.valueAllocators[table] = {}
+        if column not in self.valueAllocators[table]:
+            if column in self.aidCols:
+                colType = 'integer'
+            else:
+                colType = self.sw.getColType(table,column)
+            values = [self.baseDf[table][column]]
+            for df in self.pendingRows[table]:
+                values.append(df[column])
+            values = pd.concat(values).dropna()
+            if colType == 'text':
+                # Only the largest value matters, so each distinct value is looked at once
+                values = pd.Series(pd.unique(values)).astype(str)
+            self.valueAllocators[table][column] = valueAllocator(values,colType)
+        return self.valueAllocators[table][column]
 
-    def stripAllButX(self,table,query,numLeft=1):
+    def stripAllButX(self,table,query,numLeft=1,pick='first',seed=0):
         ''' This removes the rows that match the dataframe query leaving numLeft
             number of distinct AIDs
+
+            numLeft is the number of aid1 values to leave, or a dict of aid column to
+            number of values, like {'aid1':5,'aid2':2}. The columns narrow the rows
+            left in turn: of the matching rows of the aid1 values left, only those
+            of numLeft['aid2'] aid2 values are left, and so on. The values left are
+            the first to appear in the table (pick='first') or a random choice
+            (pick='random', drawn with seed).
+        '''
+        if type(numLeft) is not dict:
+            numLeft = {'aid1':numLeft}
+        self._stripRows(table,query,numLeft,pick,seed)
+        self.syncDb(table)
+
+    def _stripRows(self,table,query,numLeft,pick='first',seed=0):
+        ''' Removes the rows that match the dataframe query, except for those of the
+            aid values that _selectAids() leaves
         '''
+        for aidCol in numLeft:
+            if aidCol not in self.aidCols:
+                print(f"ERROR: stripAllButX: {aidCol} is not an aid column (they are {self.aidCols})")
+                quit()
+        if pick not in ['first','random']:
+            print(f"ERROR: stripAllButX: unknown pick {pick}")
+            quit()
+        self.flushDf(table)
         bdf = self.baseDf[table]
-        dfRemove = bdf.query(query)
-        notQuery = f"not({query})"
-        dfKeep = bdf.query(notQuery)
-        # dfRemove contains the rows that we want to drop
-        # dfKeep contains everything else
-        # We want to shift rows for numLeft distinct users from dfRemove to dfKeep
-        for _ in range(numLeft):
-            aidVal = dfRemove['aid1'].iloc[0]
-            dfShift = dfRemove.query("aid1 == @aidVal")
-            dfKeep = dfKeep.append(dfShift)
-            dfRemove = dfRemove.query("aid1 != @aidVal")
-        self.baseDf[table] = dfKeep
-        self.conn = sqlite3.connect(self.dbPath)
-        dfKeep.to_sql(table,con=self.conn, if_exists='replace')
-        self.conn.close()
+        matched = np.flatnonzero(self._queryMask(bdf,query).to_numpy())
+        aids = {aidCol:bdf[aidCol].to_numpy()[matched] for aidCol in numLeft}
+        remove = np.zeros(len(bdf),dtype=bool)
+        remove[matched[~self._selectAids(aids,len(matched),numLeft,pick,seed)]] = True
+        self._noteDbChange(self.dbDeleted,table,bdf.index[remove])
+        self.baseDf[table] = bdf[~remove]
+
+    def _selectAids(self,aids,numRows,numLeft,pick,seed):
+        ''' Returns the mask of the numRows rows to leave (none if numLeft is empty),
+            given each aid column's values in `aids`. Each column is factorized once (codes in order of first
+            appearance), so choosing its values to leave is one array lookup.
+        '''
+        rng = np.random.default_rng(seed)
+        leave = np.full(numRows,len(numLeft) > 0)
+        for aidCol,count in numLeft.items():
+            codes,uniques = pd.factorize(aids[aidCol][leave])
+            count = min(count,len(uniques))
+            if pick == 'first':
+                chosen = np.arange(count)
+            else:
+                chosen = rng.choice(len(uniques),size=count,replace=False)
+            isChosen = np.zeros(len(uniques),dtype=bool)
+            isChosen[chosen] = True
+            leave[leave] = isChosen[codes]
+        return leave
     
-    def _processOneTable(self,table,data):
+    def _processOneTable(self,table):
+        ''' Yields the working values of each combination that works. The coverage
+            report is made once all combinations have been tried.
+        '''
         columns = list(self.sw.iterCols(table))
-        # Make all possible True/False column combinations
-        for comb in itertools.product([True,False],repeat=len(self.conditions)):
-            ''' For each combination, loop through each column and try to find a value
-                that satisfies all of the conditions in the combination (noting that a
-                given column can be in more than one condition). The approach will be
-                to find valid values for all conditions, and then check each one against
-                all other conditions to see if it passes all. If no values work for all
-                conditions, then we presume that the conditions can't be satisfied and
-                we move on. (This may fail to find working values when such values exist.)
-            '''
-            values = []
-            # We are going to find all of the candidate values for all columns in advance,
-            # and then resolve them, because some conditions can involve multiple columns
-            candidateValues = {}
-            relevantConditions = {}
-            relevantResults = {}
-            for column in columns:
-                candidateValues[column] = []
-                relevantConditions[column],relevantResults[column] = self._getRelevantConditions(column,comb)
-                if self.dop:
-                    print(f"column {column}, relevantConditions {relevantConditions}, relevantResults {relevantResults}")
-                for i in range(len(relevantConditions[column])):
-                    condition = relevantConditions[column][i]
-                    result = relevantResults[column][i]
-                    # At this point, `result` is the desired True/False result of `condition`
-                    self._addCandidateValues(candidateValues[column],condition,result)
-            # Now see if any of the candidate values work. For now we don't deal with multi-column
-            # conditions
-            allValuesWork = True
-            for column in columns:
-                workingValueList = self._findWorkingValue(candidateValues,column,
-                                                      relevantConditions, relevantResults)
-                if len(workingValueList) == 0:
-                    # can't find values for this combination
-                    self._addFailedCombination(columns,column,comb,
-                                               relevantConditions[column],candidateValues[column])
-                    allValuesWork = False
-                else:
-                    values.append(workingValueList)
-            if allValuesWork is False:
+        self._prepareColumns(table,columns)
+        combinations = self._getCombinations()
+        workingCombinations = set()
+        yield from self._solveCombinations(columns,combinations,workingCombinations)
+        self.coverageReport[table] = self._makeCoverageReport(combinations,workingCombinations)
+
+    def _solveCombinations(self,columns,combinations,workingCombinations):
+        ''' Yields the working values of each of the combinations that works '''
+        numTried = 0
+        numFailed = 0
+        for comb in combinations:
+            numTried += 1
+            if self.factorColumns:
+                values = self._getFactoredValues(columns,comb)
+            else:
+                values = self._getCombinationValues(columns,comb)
+            if values is None:
+                numFailed += 1
                 continue
+            if self.coverage == 'mcdc':
+                workingCombinations.add(comb)
             # `values` contains the list of working values in the order that the columns
             # appear in the sqlite table
-            for _ in range(self.numRowsPerCombination):
-                self._makeRows(data,values)
+            yield values
+        self.profiler.count('combinationsTried',numTried)
+        self.profiler.count('combinationsFailed',numFailed)
+
+    def _iterRowChunks(self,table):
+        ''' Yields the table's rows in chunks of chunkRows rows (the last one may be
+            shorter). A combination with more rows than fit in the current chunk is
+            made a piece at a time.
+        '''
+        columns = self.aidCols + list(self.sw.iterCols(table))
+        if self.numWorkers > 1:
+            yield from self._splitChunks(columns,self._iterShardChunks(table))
+            return
+        pending = []
+        numPending = 0
+        for values in self._processOneTable(table):
+            numRows = self._countRows(values)
+            start = 0
+            while start < numRows:
+                stop = min(numRows,start + self.chunkRows - numPending)
+                pending.append(self._makeRows(table,values,start,stop))
+                numPending += stop - start
+                start = stop
+                if numPending == self.chunkRows:
+                    yield {column:self._concatChunks(table,column,pending) for column in columns}
+                    pending = []
+                    numPending = 0
+        if numPending > 0:
+            yield {column:self._concatChunks(table,column,pending) for column in columns}
+
+    def _splitChunks(self,columns,chunks):
+        ''' Re-cuts a stream of chunks of any size into chunks of chunkRows rows '''
+        pending = []
+        numPending = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            numPending += len(chunk[columns[0]])
+            if numPending < self.chunkRows:
+                continue
+            joined = {column:np.concatenate([piece[column] for piece in pending]) for column in columns}
+            start = 0
+            while numPending - start >= self.chunkRows:
+                yield {column:joined[column][start:start+self.chunkRows] for column in columns}
+                start += self.chunkRows
+            pending = [{column:joined[column][start:] for column in columns}]
+            numPending -= start
+        if numPending > 0:
+            yield {column:np.concatenate([piece[column] for piece in pending]) for column in columns}
+
+    def _iterShardChunks(self,table):
+        ''' Yields the table's rows, one chunk per shard, in combination order. Each
+            shard is a run of rows from _iterShardRanges(), made by a worker process
+            with makeShard(). At most two shards per worker are in flight, so finished
+            shards don't pile up in memory.
+        '''
+        combinations = self._getCombinations()
+        options = {'numRowsPerCombination':self.numRowsPerCombination,
+                   'factorColumns':self.factorColumns,
+                   'coverage':self.coverage,
+                   'valueSolver':self.valueSolver,
+                   'dop':self.dop}
+        workingCombinations = set()
+        with concurrent.futures.ProcessPoolExecutor(self.numWorkers) as pool:
+            futures = collections.deque()
+            for start,stop,firstRow,numRows in self._iterShardRanges(table):
+                futures.append(pool.submit(makeShard,self.sw,options,table,start,stop,firstRow,numRows,
+                                           self.sample,bool(self.profiler)))
+                if len(futures) < 2 * self.numWorkers:
+                    continue
+                chunk = self._mergeShard(table,futures.popleft().result(),workingCombinations)
+                if chunk is not None:
+                    yield chunk
+            while len(futures) > 0:
+                chunk = self._mergeShard(table,futures.popleft().result(),workingCombinations)
+                if chunk is not None:
+                    yield chunk
+        self.coverageReport[table] = self._makeCoverageReport(combinations,workingCombinations)
+
+    def _iterShardRanges(self,table):
+        ''' Yields the table's shards as (start, stop, firstRow, numRows): numRows rows
+            of the combinations at positions start to stop of _getCombinations(),
+            starting at row firstRow of the first one. A shard ends once it has
+            chunkRows rows, splitting a combination with more, so a shard takes about
+            as much memory as a chunk of streamBaseTables(). It also ends after a
+            quarter of each worker's share of the combinations, so that a table of few
+            rows still keeps all of the workers busy.
+        '''
+        columns = list(self.sw.iterCols(table))
+        self._prepareColumns(table,columns)
+        sizes = self._getColumnSizes(columns)
+        maxCombinations = max(1,-(-self._countCombinations() // (self.numWorkers * 4)))
+        start,firstRow,numRows = 0,0,0
+        position = 0
+        for comb in self._getCombinations():
+            numCombRows = self.numRowsPerCombination
+            for column in columns:
+                numCombRows *= sizes[column][tuple(comb[i] for i in self.columnCache[column]['positions'])]
+            row = 0
+            # The rest of the combination fills the shard
+            while numCombRows - row >= self.chunkRows - numRows:
+                row += self.chunkRows - numRows
+                yield start,position+1,firstRow,self.chunkRows
+                start,firstRow,numRows = position,row,0
+            numRows += numCombRows - row
+            position += 1
+            if position - start >= maxCombinations:
+                yield start,position,firstRow,numRows
+                start,firstRow,numRows = position,0,0
+        if position > start:
+            yield start,position,firstRow,numRows
+
+    def _mergeShard(self,table,shard,workingCombinations):
+        ''' Adds the aid columns to a shard made by makeShard(), turns its text codes
+            back into text, and takes in its failed and working combinations. Returns
+            None for a shard with no rows (whose empty columns may not have the right
+            dtype).
+        '''
+        shardChunk,counts,offsets,failedCombinations,shardWorking,profile = shard
+        self.profiler.merge(profile)
+        self.failedCombinations += failedCombinations
+        workingCombinations.update(shardWorking)
+        if len(counts) == 0:
+            return None
+        chunk = {}
+        for i in range(len(self.aidCols)):
+            chunk[self.aidCols[i]] = self.aidManagers[i].nextAidsForBatches(counts,offsets)
+        for column,values in shardChunk.items():
+            if type(values) is tuple:
+                codes,valueArray = values
+                values = valueArray[codes]
+            chunk[column] = values
+        return chunk
+
+    def _prepareShards(self,table):
+        ''' Readies a worker's rowFiller to make shards of the table with _makeShard() '''
+        self._startTable(table)
+        self._prepareColumns(table,list(self.sw.iterCols(table)))
+
+    def _makeShard(self,table,start,stop,firstRow,numRows):
+        ''' Makes numRows rows, without aid columns, of the combinations at positions
+            start to stop of _getCombinations(), starting at row firstRow of the first.
+            Returns the chunk, the number of rows made of each working combination and
+            the row of the combination they start at, the failed and working
+            combinations, and the profile. Text columns come back as (codes, values),
+            with codes the positions in the array of values, in the smallest unsigned
+            dtype, as that is much quicker to send back than the text.
+        '''
+        columns = list(self.sw.iterCols(table))
+        self.failedCombinations = []
+        workingCombinations = set()
+        data = []
+        counts = []
+        offsets = []
+        row = firstRow
+        for values in self._solveCombinations(columns,self._iterCombinationRange(start,stop),workingCombinations):
+            count = min(self._countRows(values) - row,numRows)
+            if count > 0:
+                data.append(self._makeRows(table,values,row,row+count))
+                counts.append(count)
+                offsets.append(row)
+                numRows -= count
+            row = 0
+        chunk = {}
+        for column in columns:
+            chunk[column] = self._concatChunks(table,column,data)
+            if self.sw.getColType(table,column) == 'text':
+                codes,valueArray = pd.factorize(chunk[column])
+                chunk[column] = (codes.astype(np.min_scalar_type(len(valueArray))),valueArray)
+        profile = self.profiler.getReport()
+        self.profiler.reset()
+        return (chunk,np.array(counts,dtype=np.int64),np.array(offsets,dtype=np.int64),
+                self.failedCombinations,workingCombinations,profile)
+
+    def _iterCombinationRange(self,start,stop):
+        ''' Yields the combinations at positions start to stop of _getCombinations().
+            With coverage 'all', a combination is worked out from its position (its
+            bits, False for 1), so the ones before start are never made.
+        '''
+        if self.coverage == 'all' and self.sample is None:
+            numConditions = len(self.conditions)
+            for position in range(start,stop):
+                yield tuple(((position >> (numConditions-1-i)) & 1) == 0 for i in range(numConditions))
+            return
+        yield from itertools.islice(self._getCombinations(),start,stop)
+
+    def _getCombinations(self):
+        ''' Returns the True/False condition combinations to generate rows for '''
+        if self.coverage == 'all':
+            if self.sample is not None:
+                return self._iterSample(None)
+            # Make all possible True/False column combinations
+            return itertools.product([True,False],repeat=len(self.conditions))
+        combinations = self._getMcdcCombinations()
+        if self.sample is not None:
+            return list(self._iterSample(combinations))
+        return combinations
+
+    def _getMcdcCombinations(self):
+        combinations = []
+        for pair in self.sw.getMcdcPairs():
+            for comb in pair:
+                if comb not in combinations:
+                    combinations.append(comb)
+        return combinations
+
+    def _countCombinations(self):
+        ''' Returns the number of combinations that _getCombinations() returns '''
+        if self.sample is not None:
+            return self.sample[0]
+        if self.coverage == 'all':
+            return 2 ** len(self.conditions)
+        return len(self._getCombinations())
+
+    def _iterSample(self,combinations):
+        ''' Yields the sampled combinations: the last of each of `keep` equal parts of
+            the `outOf` working combinations made of the sample's column assignments,
+            in the order _getCombinations() would give them. With coverage 'all', those
+            are every choice of one assignment per column, so the combination at a
+            position is worked out from the position (a digit per column), and the
+            combinations that are skipped are never made.
+        '''
+        keep,outOf,assignments = self.sample
+        positions = [(j * outOf - 1) // keep for j in range(1,keep+1)]
+        if combinations is not None:
+            working = self._selectAssigned(combinations,assignments)
+            for position in positions:
+                yield working[position]
+            return
+        sample = []
+        for position in positions:
+            comb = [None] * len(self.conditions)
+            for column in reversed(list(assignments)):
+                position,digit = divmod(position,len(assignments[column]))
+                for i,result in zip(self.columnCache[column]['positions'],assignments[column][digit]):
+                    comb[i] = result
+            sample.append(tuple(comb))
+        # False sorts before True, and itertools.product() gives True first
+        sample.sort(key=lambda comb: tuple(not result for result in comb))
+        yield from sample
+
+    def _selectAssigned(self,combinations,assignments):
+        ''' Returns the combinations where each column has one of its `assignments` '''
+        assigned = {column:set(subCombs) for column,subCombs in assignments.items()}
+        return [comb for comb in combinations
+                if all(tuple(comb[i] for i in self.columnCache[column]['positions']) in assigned[column]
+                       for column in assigned)]
+
+    def _makeCoverageReport(self,combinations,workingCombinations):
+        if self.coverage == 'all':
+            numCombinations = 2 ** len(self.conditions)
+            failed = set(tuple(f['combination']) for f in self.failedCombinations)
+            if self.sample is not None:
+                return {'coverage':'sampled',
+                        'numCombinations':numCombinations,
+                        'numSampledCombinations':self.sample[0],
+                        'numWorkingCombinations':self.sample[0] - len(failed)}
+            return {'coverage':'all',
+                    'numCombinations':numCombinations,
+                    'numWorkingCombinations':numCombinations - len(failed)}
+        covered = []
+        uncovered = []
+        pairs = self.sw.getMcdcPairs()
+        for i in range(len(pairs)):
+            if pairs[i][0] in workingCombinations and pairs[i][1] in workingCombinations:
+                covered.append(i)
+            else:
+                uncovered.append(i)
+        report = {'coverage':'mcdc' if len(uncovered) == 0 else 'partial mcdc',
+                  'numCombinations':len(combinations),
+                  'numWorkingCombinations':len(workingCombinations),
+                  'coveredConditions':covered,
+                  'uncoveredConditions':uncovered}
+        if self.sample is not None:
+            report['numCombinations'] = len(self._getMcdcCombinations())
+            report['numSampledCombinations'] = self.sample[0]
+        return report
+
+    def _getCombinationValues(self,columns,comb):
+        ''' For each combination, loop through each column and try to find a value
+            that satisfies all of the conditions in the combination (noting that a
+            given column can be in more than one condition). The approach will be
+            to find valid values for all conditions, and then check each one against
+            all other conditions to see if it passes all. If no values work for all
+            conditions, then we presume that the conditions can't be satisfied and
+            we move on. (This may fail to find working values when such values exist.)
+            Returns the list of working value lists, or None if the combination fails.
+        '''
+        values = []
+        # For now we don't deal with multi-column conditions
+        allValuesWork = True
+        for column in columns:
+            relevantConditions,relevantResults,relevantPositions = self._getRelevantConditions(column,comb)
+            workingValueList = self._findWorkingValue(column,relevantPositions,relevantResults)
+            if len(workingValueList) == 0:
+                # can't find values for this combination
+                self._addFailedCombination(columns,column,comb,relevantConditions,
+                        self._getCandidateValues(column,relevantPositions,relevantResults))
+                allValuesWork = False
+            else:
+                values.append(workingValueList)
+        if allValuesWork is False:
+            return None
+        return values
+
+    def _prepareColumns(self,table,columns):
+        ''' Records, for each column, the positions in self.conditions of the conditions
+            on that column, and builds the column's candidate table. The table holds every
+            candidate value that any (condition, result) on the column proposes, and for
+            each (condition, result) the mask of candidates that pass it. Finding the working
+            values for any one combination is then a few array operations.
+        '''
+        self.columnCache = {}
+        self.columnDtypes[table] = {}
+        with self.profiler.time('candidates'):
+            for column in columns:
+                positions = self.sw.getConditionPositions(table,column)
+                candidateValues = []
+                candidateIndex = {}
+                candidateLists = {}
+                candidatePositions = {}
+                for position in positions:
+                    for result in [True,False]:
+                        # At this point, `result` is the desired True/False result of the condition
+                        valueLists = []
+                        self._addCandidateValues(valueLists,self.conditions[position],result)
+                        candidateLists[(position,result)] = valueLists
+                        indexes = []
+                        for valueList in valueLists:
+                            for value in valueList:
+                                # 2 and 2.0 are different candidates
+                                key = (type(value),value)
+                                if key not in candidateIndex:
+                                    candidateIndex[key] = len(candidateValues)
+                                    candidateValues.append(value)
+                                indexes.append(candidateIndex[key])
+                        candidatePositions[(position,result)] = np.array(indexes,dtype=np.intp)
+                self.profiler.count('candidateValues',len(candidateValues))
+                self.columnDtypes[table][column] = self._getColumnDtype(table,column,candidateValues)
+                candidateArray = self._makeCandidateArray(candidateValues)
+                passes = {}
+                for position in positions:
+                    for result in [True,False]:
+                        passes[(position,result)] = self._getPredicate(position,result).test(candidateArray)
+                self.columnCache[column] = {'positions':positions,
+                                            'colType':self.sw.getColType(table,column),
+                                            'solved':{},
+                                            'candidateValues':candidateValues,
+                                            'candidateLists':candidateLists,
+                                            'candidatePositions':candidatePositions,
+                                            'passes':passes}
+
+    def _getColumnValues(self,column,subComb):
+        ''' Returns the cached (workingValueList, relevantConditions, candidateValues)
+            for `column` when its own conditions have the results in `subComb`
+        '''
+        entry = self.columnCache[column]
+        if subComb in entry['solved']:
+            return entry['solved'][subComb]
+        relevantConditions = [self.conditions[i] for i in entry['positions']]
+        workingValueList = self._findWorkingValue(column,entry['positions'],subComb)
+        candidateValues = self._getCandidateValues(column,entry['positions'],subComb)
+        entry['solved'][subComb] = (workingValueList,relevantConditions,candidateValues)
+        return entry['solved'][subComb]
+
+    def _getFactoredValues(self,columns,comb):
+        ''' Same as _getCombinationValues, but assembles the combination from the
+            per-column cache so that each column is only solved once per assignment
+            of its own conditions
+        '''
+        values = []
+        allValuesWork = True
+        for column in columns:
+            subComb = tuple(comb[i] for i in self.columnCache[column]['positions'])
+            workingValueList,conditions,candidates = self._getColumnValues(column,subComb)
+            if len(workingValueList) == 0:
+                self._addFailedCombination(columns,column,comb,conditions,candidates)
+                allValuesWork = False
+            else:
+                values.append(workingValueList)
+        if allValuesWork is False:
+            return None
+        return values
 
     def _addFailedCombination(self,columns,column,comb,conditions,values):
         self.failedCombinations.append({'columns':columns,
@@ -241,48 +1566,142 @@ class rowFiller:
                                         'conditions':conditions})
 
     def _getRelevantConditions(self,column,comb):
-        relevantConditions = []
-        relevantResults = []
-        for i in range(len(self.conditions)):
-            condition = self.conditions[i]
-            result = comb[i]
-            # At this point, `result` is the desired True/False result of `condition`
-            condColumn = self.sw.getColName(condition)
-            if column == condColumn:
-                relevantConditions.append(condition)
-                relevantResults.append(result)
-        return relevantConditions,relevantResults
-
-    def _findWorkingValue(self,candidateValues,column,relevantConditions,relevantResults):
-        values = []
-        for valueList in candidateValues[column]:
-            for value in valueList:
-                if self.dop: print(f"findWorkingValue: column {column}, value {value}")
-                passed = True
-                for i in range(len(relevantConditions[column])):
-                    if self._valuePasses(value,relevantConditions[column][i],
-                                         relevantResults[column][i]) is False:
-                        passed = False
-                        break
-                if passed is True:
-                    # Found working value
-                    values.append(value)
-                else:
-                    continue    # try next value
-        return values
+        relevantPositions = self.columnCache[column]['positions']
+        relevantConditions = [self.conditions[i] for i in relevantPositions]
+        # `relevantResults` holds the desired True/False result of each relevant condition
+        relevantResults = [comb[i] for i in relevantPositions]
+        return relevantConditions,relevantResults,relevantPositions
+
+    def _getPredicate(self,position,result):
+        ''' Returns the compiled predicate for the condition at `position` and the
+            wanted result, compiling it the first time
+        '''
+        key = (position,result)
+        if key not in self.predicates:
+            condition = self.conditions[position]
+            self.predicates[key] = whereEvaluator.conditionPredicate(
+                    self.sw.getOperation(condition),self.sw.getOperands(condition),result)
+        return self.predicates[key]
 
-    def _makeRows(self,data,values):
+    def _getCandidateValues(self,column,positions,results):
+        ''' Returns the candidate value lists proposed by the conditions on the column '''
+        candidateLists = self.columnCache[column]['candidateLists']
+        candidateValues = []
+        for i in range(len(positions)):
+            candidateValues += candidateLists[(positions[i],results[i])]
+        return candidateValues
+
+    def _findWorkingValue(self,column,positions,results):
+        ''' Returns, in order, the candidate values proposed by the column's conditions
+            that pass all of them, using the column's candidate table
+        '''
+        with self.profiler.time('workingValues'):
+            if self.valueSolver == 'interval':
+                return self._solveColumn(column,positions,results)
+            entry = self.columnCache[column]
+            keys = [(positions[i],results[i]) for i in range(len(positions))]
+            indexes = np.concatenate([entry['candidatePositions'][key] for key in keys])
+            passed = np.logical_and.reduce([entry['passes'][key] for key in keys])
+            values = [entry['candidateValues'][i] for i in indexes[passed[indexes]]]
+            self.profiler.count('candidatesEvaluated',len(indexes))
+            if len(values) == 0 and self.valueSolver == 'hybrid':
+                return self._solveColumn(column,positions,results)
+            return values
+
+    def _solveColumn(self,column,positions,results):
+        ''' Returns a one-value working list from constraintSolver, or an empty list
+            if the column's conditions can't all have the wanted results
+        '''
+        self.profiler.count('intervalSolves')
+        solver = constraintSolver.constraintSolver(self.columnCache[column]['colType'])
+        for i in range(len(positions)):
+            condition = self.conditions[positions[i]]
+            solver.add(self.sw.getOperation(condition),self.sw.getOperands(condition),results[i])
+        satisfiable,value = solver.solve()
+        if satisfiable:
+            return [value]
+        return []
+
+    def _getColumnDtype(self,table,column,candidateValues):
+        ''' Returns the dtype of the column's rows. It is decided once per table, from
+            every value the column's conditions can propose, so that every chunk of
+            rows has the same dtype. An integer column with a non-integer operand, as
+            in i1 > 1.5, can get non-integer values, so it is float64.
+        '''
+        colType = self.sw.getColType(table,column)
+        if colType == 'text':
+            return np.dtype(object)
+        if colType == 'real' or any(type(value) is float for value in candidateValues):
+            return np.dtype(np.float64)
+        return np.dtype(np.int64)
+
+    def _makeCandidateArray(self,values):
+        if any(type(value) is str for value in values):
+            valueArray = np.empty(len(values),dtype=object)
+            valueArray[:] = values
+            return valueArray
+        return np.asarray(values)
+
+    def _countRows(self,values):
+        numRows = self.numRowsPerCombination
+        for valueList in values:
+            numRows *= len(valueList)
+        return numRows
+
+    def _makeRows(self,table,values,start=0,stop=None):
         ''' Because of IN(), coming in here one or more of the items in `values`
             can be a list of more than one value. In that case, we want to make
-            a row for all possible combinations of those values.
+            a row for all possible combinations of those values. The whole product
+            is repeated numRowsPerCombination times.
+
+            Rows are built column-wise: in the product, each column is its value list
+            with every value repeated (once per combination of the columns to its
+            right) and then tiled. The AIDs are handed out as one block.
+            Only rows start to stop (default all) of the combination are made. Row r
+            of a column is then value (r // inner) mod (number of values).
+            Returns the chunk as a dict of column name to numpy array.
         '''
-        rows = []
-        for row in itertools.product(*self.aidDummies,*values):
-            rows.append(list(row))
-        for row in rows:
-            for i in range(len(self.aidDummies)):
-                row[i] = self.aidManagers[i].nextAid()
-            data.append(row)
+        with self.profiler.time('rows'):
+            columns = list(self.sw.iterCols(table))
+            numProduct = 1
+            for valueList in values:
+                numProduct *= len(valueList)
+            numRows = numProduct * self.numRowsPerCombination
+            if stop is None:
+                stop = numRows
+            self.profiler.count('rowsEmitted',stop-start)
+            chunk = {}
+            for i in range(len(self.aidCols)):
+                chunk[self.aidCols[i]] = self.aidManagers[i].nextAids(stop-start,start)
+            rows = None
+            inner = numProduct
+            for i in range(len(columns)):
+                valueArray = self._makeValueArray(table,columns[i],values[i])
+                inner //= len(valueArray)
+                if start == 0 and stop == numRows:
+                    outer = numRows // (len(valueArray) * inner)
+                    chunk[columns[i]] = np.tile(np.repeat(valueArray,inner),outer)
+                    continue
+                if rows is None:
+                    rows = np.arange(start,stop)
+                chunk[columns[i]] = valueArray[(rows // inner) % len(valueArray)]
+            return chunk
+
+    def _makeValueArray(self,table,column,valueList):
+        ''' Makes a numpy array, in the column's dtype, from a list of column values '''
+        dtype = self.columnDtypes[table][column]
+        if dtype == object:
+            valueArray = np.empty(len(valueList),dtype=object)
+            valueArray[:] = valueList
+            return valueArray
+        return np.asarray(valueList,dtype=dtype)
+
+    def _concatChunks(self,table,column,data):
+        if len(data) == 0:
+            if column in self.aidCols:
+                return np.empty(0,dtype=np.int64)
+            return self._makeValueArray(table,column,[])
+        return np.concatenate([chunk[column] for chunk in data])
 
     def _addCandidateValues(self,candidateValues,condition,result):
         operation = self.sw.getOperation(condition)
@@ -305,51 +1724,13 @@ class rowFiller:
             self._addSmallerValues(operands[0],candidateValues)
             self._addBiggerValues(operands[1],candidateValues)
         elif (operation == 'in' and result is True):
-            candidateValues.append(operands[0])
+            candidateValues.append(whereEvaluator.inList(operands[0]))
         elif (operation == 'in' and result is False):
-            self._addBiggerValues(max(operands[0]),candidateValues)
+            self._addBiggerValues(max(whereEvaluator.inList(operands[0])),candidateValues)
         else:
             print(f"Error: addCandidateValues: no matching branch {condition}, {result}")
             quit()
 
-    def _valuePasses(self,value,condition,result):
-        operation = self.sw.getOperation(condition)
-        operands = self.sw.getOperands(condition)
-        pass
-        retVal = False
-        if self.dop: print(f"    valuePasses, value {value} operation {operation}, operands {operands}, result {result}")
-        if ((operation == 'eq' and result is True) or
-            (operation == 'neq' and result is False)):
-            if value == operands[0]: retVal = True
-        elif ((operation == 'eq' and result is False) or
-            (operation == 'neq' and result is True)):
-            if value != operands[0]: retVal = True
-        elif ((operation == 'gt' and result is True) or
-            (operation == 'lte' and result is False)):
-            if value > operands[0]: retVal = True
-        elif ((operation == 'gt' and result is False) or
-            (operation == 'lte' and result is True)):
-            if value <= operands[0]: retVal = True
-        elif ((operation == 'lt' and result is True) or
-            (operation == 'gte' and result is False)):
-            if value < operands[0]: retVal = True
-        elif ((operation == 'lt' and result is False) or
-            (operation == 'gte' and result is True)):
-            if value >= operands[0]: retVal = True
-        elif (operation == 'between' and result is True):
-            if value >= operands[0] and value <= operands[1]: retVal = True
-        elif (operation == 'between' and result is False):
-            if value < operands[0] or value > operands[1]: retVal = True
-        elif (operation == 'in' and result is True):
-            if value in operands[0]: retVal = True
-        elif (operation == 'in' and result is False):
-            if value not in operands[0]: retVal = True
-        else:
-            print(f"Error: valuePasses: no matching branch {condition}, {result}")
-            quit()
-        if self.dop: print(f"        return value is {retVal}")
-        return retVal
-
     def _addBiggerValues(self,value,valList):
         if type(value) is str:
             # Not guaranteed to be bigger, but good chance
@@ -393,7 +1774,27 @@ class rowFiller:
                 dbName += self.sw.getColName(condition)
                 dbName += self.sw.getOperation(condition)
                 dbName += str(self.sw.getOperands(condition)[0])
-        return dbName + '.db'
+        # The name is cut short, so clauses that start alike would share it without
+        # the content hash
+        return dbName[:self.maxDbName] + '_' + self.contentKey[:16] + '.db'
+
+# The rowFiller a worker process made its last shard with, and what it was made for.
+# It is kept while the shards are of the same table, so that a worker solves the
+# table's columns once rather than once per shard.
+shardFiller = None
+shardFillerKey = None
+
+def makeShard(sw,options,table,start,stop,firstRow,numRows,sample=None,profile=False):
+    ''' Runs in a worker process: makes one shard of rows for rowFiller._iterShardChunks() '''
+    global shardFiller,shardFillerKey
+    key = (sw.sqlStr,options,table,sample,profile)
+    if shardFiller is None or shardFillerKey != key:
+        profiler = phaseProfiler.phaseProfiler() if profile else None
+        shardFiller = rowFiller(sw,aidSpec=[],printIntermediateTables=False,profiler=profiler,**options)
+        shardFiller.sample = sample
+        shardFiller._prepareShards(table)
+        shardFillerKey = key
+    return shardFiller._makeShard(table,start,stop,firstRow,numRows)
 
 if __name__ == "__main__":
     pp = pprint.PrettyPrinter(indent=4)
@@ -422,7 +1823,8 @@ if __name__ == "__main__":
         rf.stripAllButX(test['strip']['table'],test['strip']['query'])
         print("Stripped base dataframe:")
         pp.pprint(rf.baseDf)
+        answers = rf.queryDbBatch([test['attack1'],test['attack2']])
         print(f"{test['attack1']}:")
-        pp.pprint(rf.queryDb(test['attack1']))
+        pp.pprint(answers[0])
         print(f"{test['attack2']}:")
-        pp.pprint(rf.queryDb(test['attack2']))
\ No newline at end of file
+        pp.pprint(answers[1])
\ No newline at end of file
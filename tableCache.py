@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import sqlite3
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) the cache still works, but is not safe to share
+    # between processes
+    fcntl = None
+
+def makeKey(parts):
+    ''' Returns the hex sha256 of parts (a dict that json can encode) '''
+    text = json.dumps(parts,sort_keys=True,default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class tableCache:
+    """ A size-bounded on-disk cache of generated dbs, keyed on a hash of everything
+        that decides their content (see makeKey())
+
+        Each entry is <key>.db, a copy of the db, and <key>.meta, a pickle of whatever
+        else the generator wants back (failed combinations and so on). Dbs are copied
+        in and out with sqlite's backup api, so the db being cached can also be an
+        in-memory one. When the entries take more than maxBytes, the least recently
+        used are removed (a hit marks an entry used by touching its files).
+
+        Several processes can share one cache directory. Readers hold a shared lock
+        on the directory's lock file and writers an exclusive one, and new entries
+        are written to temporary files and renamed into place.
+    """
+    def __init__(self,directory=os.path.join('tables','cache'),maxBytes=2**30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory,exist_ok=True)
+        self.lockPath = os.path.join(directory,'.lock')
+
+    def getDbPath(self,key):
+        return os.path.join(self.directory,f"{key}.db")
+
+    def getMetaPath(self,key):
+        return os.path.join(self.directory,f"{key}.meta")
+
+    def get(self,key,conn):
+        ''' Copies the cached db into the sqlite connection conn and returns its
+            metadata, or returns None if key is not in the cache
+        '''
+        with self._locked(exclusive=False):
+            dbPath = self.getDbPath(key)
+            if not os.path.exists(dbPath):
+                self.misses += 1
+                return None
+            with open(self.getMetaPath(key),'rb') as f:
+                metadata = pickle.load(f)
+            cached = sqlite3.connect(dbPath)
+            try:
+                cached.backup(conn)
+            finally:
+                cached.close()
+            now = time.time()
+            os.utime(dbPath,(now,now))
+            os.utime(self.getMetaPath(key),(now,now))
+        self.hits += 1
+        return metadata
+
+    def put(self,key,conn,metadata):
+        ''' Stores the db open on conn, with its metadata, under key '''
+        tmpDbPath = f"{self.getDbPath(key)}.{os.getpid()}.tmp"
+        tmpMetaPath = f"{self.getMetaPath(key)}.{os.getpid()}.tmp"
+        copy = sqlite3.connect(tmpDbPath)
+        try:
+            conn.backup(copy)
+        finally:
+            copy.close()
+        with open(tmpMetaPath,'wb') as f:
+            pickle.dump(metadata,f)
+        with self._locked(exclusive=True):
+            os.replace(tmpMetaPath,self.getMetaPath(key))
+            os.replace(tmpDbPath,self.getDbPath(key))
+            self._evict()
+
+    def getSize(self):
+        ''' Returns the bytes taken by the cache entries '''
+        return sum(size for _,_,size in self._listEntries())
+
+    def clear(self):
+        with self._locked(exclusive=True):
+            for key,_,_ in self._listEntries():
+                self._remove(key)
+
+    def _listEntries(self):
+        ''' Returns (key, last use, bytes) for each entry '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.db'):
+                continue
+            key = name[:-len('.db')]
+            try:
+                dbStat = os.stat(self.getDbPath(key))
+                metaSize = os.stat(self.getMetaPath(key)).st_size
+            except FileNotFoundError:
+                continue
+            entries.append((key,dbStat.st_mtime,dbStat.st_size + metaSize))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._listEntries(),key=lambda entry: entry[1])
+        total = sum(size for _,_,size in entries)
+        for key,_,size in entries:
+            if total <= self.maxBytes:
+                break
+            self._remove(key)
+            total -= size
+
+    def _remove(self,key):
+        for path in [self.getDbPath(key),self.getMetaPath(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @contextlib.contextmanager
+    def _locked(self,exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lockPath,'a') as lockFile:
+            fcntl.flock(lockFile,fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile,fcntl.LOCK_UN)
@@ -0,0 +1,293 @@
+import os
+import csv
+import json
+import struct
+import sqlite3
+import lazyImport
+
+np = lazyImport.lazyImport('numpy')
+
+# sqlite column type for each of our column types
+sqliteTypes = {'integer':'INTEGER','real':'REAL','text':'TEXT'}
+
+class sqliteSink:
+    """ Writes tables chunk by chunk into a sqlite db
+
+        For each table, begin() creates it, write() inserts one chunk of rows and
+        end() builds the index and commits. A chunk is a dict of column name to
+        numpy array (or pandas Categorical), and comes with the row ids of its rows.
+        The row id is stored in the column "index". resume() lets write() (and
+        delete()) change a table that is already in the db. With uri=True, dbPath is
+        an sqlite uri. rowFiller writes its db, streamed or not, through one of these.
+    """
+    def __init__(self,dbPath,pageSize=32768,uri=False):
+        self.dbPath = dbPath
+        if not uri and os.path.dirname(dbPath):
+            # Like tables/ for rowFiller's dbs, which isn't kept in the repo
+            os.makedirs(os.path.dirname(dbPath),exist_ok=True)
+        self.conn = sqlite3.connect(dbPath,uri=uri)
+        # page_size only takes effect on a new db, before its first table
+        self.conn.execute(f"PRAGMA page_size = {pageSize}")
+        # We can always regenerate the db, so trade durability for speed
+        self.conn.execute("PRAGMA journal_mode = MEMORY")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.insertSql = {}
+        self.columns = {}
+
+    def begin(self,table,columns,colTypes):
+        ''' colTypes maps each column to 'integer', 'real' or 'text' '''
+        colDefs = ',\n'.join(['"index" INTEGER'] + [f'"{column}" {sqliteTypes[colTypes[column]]}'
+                                                    for column in columns])
+        self.conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        self.conn.execute(f'CREATE TABLE "{table}" (\n{colDefs}\n)')
+        self.resume(table,columns)
+
+    def resume(self,table,columns):
+        ''' Readies write() for a table (with these columns) that is already in the db '''
+        colList = ','.join([f'"{column}"' for column in ['index'] + columns])
+        marks = ','.join(['?'] * (len(columns) + 1))
+        self.insertSql[table] = f'INSERT INTO "{table}" ({colList}) VALUES ({marks})'
+        self.columns[table] = columns
+
+    def write(self,table,rowIds,chunk):
+        self.conn.executemany(self.insertSql[table],
+                              makeChunkRows(self.columns[table],rowIds,chunk))
+
+    def delete(self,table,rowIds):
+        self.conn.executemany(f'DELETE FROM "{table}" WHERE "index" = ?',
+                              [(rowId,) for rowId in np.asarray(rowIds).tolist()])
+
+    def end(self,table):
+        self.conn.execute(f'CREATE INDEX "ix_{table}_index" ON "{table}" ("index")')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class csvSink:
+    """ Writes each table chunk by chunk to the file <table>.csv in directory, with a
+        header line and the row id in the first column "index"
+    """
+    def __init__(self,directory):
+        self.directory = directory
+        self.files = {}
+        self.writers = {}
+        self.columns = {}
+
+    def getPath(self,table):
+        return os.path.join(self.directory,f"{table}.csv")
+
+    def begin(self,table,columns,colTypes):
+        self.files[table] = open(self.getPath(table),'w',newline='')
+        self.writers[table] = csv.writer(self.files[table])
+        self.writers[table].writerow(['index'] + columns)
+        self.columns[table] = columns
+
+    def write(self,table,rowIds,chunk):
+        self.writers[table].writerows(makeChunkRows(self.columns[table],rowIds,chunk))
+
+    def end(self,table):
+        self.files.pop(table).close()
+        del self.writers[table]
+
+    def close(self):
+        for table in list(self.files.keys()):
+            self.end(table)
+
+class npySink:
+    """ Writes each table as one .npy file per column in directory/<table>/, so that
+        a consumer can np.load(path, mmap_mode='r') a column of any size without
+        reading it (see openNpyTable())
+
+        Chunks are written straight to the files as raw bytes. Each file starts with
+        a header of fixed size whose shape is filled in by end(), once the number of
+        rows is known. A column's dtype is that of its first chunk. The row ids go
+        in index.npy. Text columns are stored as int32 codes (-1 for missing), and
+        the value of each code is kept in the table's schema.json.
+    """
+    headerSize = 128
+
+    def __init__(self,directory):
+        self.directory = directory
+        self.tables = {}
+
+    def getTableDir(self,table):
+        return os.path.join(self.directory,table)
+
+    def begin(self,table,columns,colTypes):
+        os.makedirs(self.getTableDir(table),exist_ok=True)
+        self.tables[table] = {'columns':columns,
+                              'colTypes':colTypes,
+                              'files':{},
+                              'dtypes':{},
+                              'categories':{column:{} for column in columns if colTypes[column] == 'text'},
+                              'numRows':0}
+
+    def write(self,table,rowIds,chunk):
+        state = self.tables[table]
+        self._writeColumn(table,'index',np.asarray(rowIds,dtype=np.int64))
+        for column in state['columns']:
+            values = chunk[column]
+            if column in state['categories']:
+                values = self._encode(state['categories'][column],values)
+            self._writeColumn(table,column,np.asarray(values))
+        state['numRows'] += len(rowIds)
+
+    def end(self,table):
+        state = self.tables.pop(table)
+        for column in ['index'] + state['columns']:
+            if column not in state['files']:
+                # No rows at all, so nothing decided the dtype
+                dtype = np.int32 if column in state['categories'] else np.int64
+                self._openColumn(table,state,column,np.dtype(dtype))
+            f = state['files'][column]
+            f.seek(0)
+            f.write(self._makeHeader(state['dtypes'][column],state['numRows']))
+            f.close()
+        schema = {'numRows':state['numRows'],
+                  'columns':state['columns'],
+                  'colTypes':state['colTypes'],
+                  'dtypes':{column:dtype.str for column,dtype in state['dtypes'].items()},
+                  'categories':{column:list(codes.keys()) for column,codes in state['categories'].items()}}
+        with open(os.path.join(self.getTableDir(table),'schema.json'),'w') as f:
+            json.dump(schema,f)
+
+    def close(self):
+        for table in list(self.tables.keys()):
+            self.end(table)
+
+    def _openColumn(self,table,state,column,dtype):
+        f = open(os.path.join(self.getTableDir(table),f"{column}.npy"),'wb')
+        f.write(b'\0' * self.headerSize)
+        state['files'][column] = f
+        state['dtypes'][column] = dtype
+
+    def _writeColumn(self,table,column,values):
+        state = self.tables[table]
+        if column not in state['files']:
+            self._openColumn(table,state,column,values.dtype)
+        dtype = state['dtypes'][column]
+        if values.dtype != dtype:
+            if not np.can_cast(values.dtype,dtype,'same_kind'):
+                print(f"ERROR: npySink: column {column} was {dtype}, but a chunk is {values.dtype}")
+                quit()
+            values = values.astype(dtype)
+        np.ascontiguousarray(values).tofile(state['files'][column])
+
+    def _encode(self,codes,values):
+        ''' Returns the int32 codes of text values, adding new values to codes (a dict
+            of value to code, in code order)
+        '''
+        if hasattr(values,'categories'):
+            # A pandas Categorical: only its categories need looking up
+            uniques = np.asarray(values.categories,dtype=object)
+            inverse = values.codes
+        else:
+            uniques,inverse = np.unique(np.asarray(values,dtype=object),return_inverse=True)
+        lookup = np.array([codes.setdefault(value,len(codes)) for value in uniques.tolist()] + [-1],
+                          dtype=np.int32)
+        # A Categorical's missing values have code -1, which picks the -1 at the end
+        return lookup[inverse]
+
+    def _makeHeader(self,dtype,numRows):
+        ''' The .npy (version 1.0) header, padded with spaces to headerSize bytes '''
+        header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+                np.lib.format.dtype_to_descr(dtype),numRows)
+        header = header.ljust(self.headerSize - 10 - 1) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H',len(header)) + header.encode('latin1')
+
+def openNpyTable(directory,table,mmapMode='r'):
+    ''' Returns (columns, schema) for a table written by npySink, where columns maps
+        each column (and 'index') to its memory-mapped array. The text of a text
+        column's code c is schema['categories'][column][c].
+    '''
+    tableDir = os.path.join(directory,table)
+    with open(os.path.join(tableDir,'schema.json')) as f:
+        schema = json.load(f)
+    columns = {}
+    for column in ['index'] + schema['columns']:
+        columns[column] = np.load(os.path.join(tableDir,f"{column}.npy"),mmap_mode=mmapMode)
+    return columns,schema
+
+class arrowSink:
+    """ Writes each table to directory/<table>.arrow (Arrow IPC file, which pyarrow can
+        memory-map) or directory/<table>.parquet, one record batch per chunk
+
+        Numeric columns are handed to Arrow without copying, and a pandas Categorical
+        becomes an Arrow dictionary array. The row ids go in the column "index".
+        Needs pyarrow, which is only imported when an arrowSink is made.
+    """
+    def __init__(self,directory,fileFormat='ipc'):
+        if fileFormat not in ['ipc','parquet']:
+            print(f"ERROR: arrowSink: unknown fileFormat {fileFormat}")
+            quit()
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            print("ERROR: arrowSink: needs pyarrow (pip install pyarrow)")
+            quit()
+        self.pa = pyarrow
+        self.directory = directory
+        self.fileFormat = fileFormat
+        self.columns = {}
+        self.colTypes = {}
+        self.writers = {}
+
+    def getPath(self,table):
+        extension = 'arrow' if self.fileFormat == 'ipc' else 'parquet'
+        return os.path.join(self.directory,f"{table}.{extension}")
+
+    def begin(self,table,columns,colTypes):
+        self.columns[table] = columns
+        self.colTypes[table] = colTypes
+        self.writers[table] = None
+
+    def write(self,table,rowIds,chunk):
+        arrays = [self.pa.array(np.asarray(rowIds,dtype=np.int64))]
+        for column in self.columns[table]:
+            arrays.append(self._toArrow(chunk[column]))
+        batch = self.pa.RecordBatch.from_arrays(arrays,names=['index'] + self.columns[table])
+        if self.writers[table] is None:
+            self._openWriter(table,batch.schema)
+        if self.fileFormat == 'ipc':
+            self.writers[table].write_batch(batch)
+        else:
+            self.writers[table].write_table(self.pa.Table.from_batches([batch]))
+
+    def end(self,table):
+        if self.writers[table] is None:
+            # No rows, so take the schema from the column types
+            types = {'integer':self.pa.int64(),'real':self.pa.float64(),'text':self.pa.string()}
+            fields = [('index',self.pa.int64())]
+            for column in self.columns[table]:
+                fields.append((column,types[self.colTypes[table][column]]))
+            self._openWriter(table,self.pa.schema(fields))
+        self.writers.pop(table).close()
+
+    def close(self):
+        for table in list(self.writers.keys()):
+            self.end(table)
+
+    def _openWriter(self,table,schema):
+        if self.fileFormat == 'ipc':
+            self.writers[table] = self.pa.ipc.new_file(self.getPath(table),schema)
+        else:
+            self.writers[table] = self.pa.parquet.ParquetWriter(self.getPath(table),schema)
+
+    def _toArrow(self,values):
+        if hasattr(values,'categories'):
+            dictionary = self.pa.array(np.asarray(values.categories,dtype=object))
+            indices = self.pa.array(values.codes,mask=values.codes < 0)
+            return self.pa.DictionaryArray.from_arrays(indices,dictionary)
+        if values.dtype == object:
+            return self.pa.array(values,type=self.pa.string())
+        return self.pa.array(values)
+
+def makeChunkRows(columns,rowIds,chunk):
+    ''' Rows of (index, columns...) as native python values '''
+    columnValues = [np.asarray(rowIds).tolist()]
+    for column in columns:
+        columnValues.append(chunk[column].tolist())
+    return zip(*columnValues)
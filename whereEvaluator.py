@@ -0,0 +1,132 @@
+import pprint
+import lazyImport
+import whereParser
+
+np = lazyImport.lazyImport('numpy')
+
+# For each operation, the function that tests a numpy array of values against the operands
+maskFunctions = {
+    'eq': lambda values,operands: values == operands[0],
+    'neq': lambda values,operands: values != operands[0],
+    'gt': lambda values,operands: values > operands[0],
+    'gte': lambda values,operands: values >= operands[0],
+    'lt': lambda values,operands: values < operands[0],
+    'lte': lambda values,operands: values <= operands[0],
+    'between': lambda values,operands: (values >= operands[0]) & (values <= operands[1]),
+    'in': lambda values,operands: np.isin(values,inList(operands[0])),
+}
+
+def conditionMask(operation,operands,values):
+    ''' Returns the boolean numpy array that is True where `values` (a numpy array of
+        one column) passes the condition
+    '''
+    if operation not in maskFunctions:
+        print(f"ERROR: conditionMask: unknown operation {operation}")
+        quit()
+    # Comparisons on object arrays can come back with dtype object
+    return np.asarray(maskFunctions[operation](values,operands),dtype=bool)
+
+def inList(operand):
+    ''' IN() with a single value parses to the value itself rather than a list '''
+    if type(operand) in [list,tuple]:
+        return list(operand)
+    return [operand]
+
+class conditionPredicate:
+    """ One condition together with the True/False result we want from it, compiled
+        once so that whole arrays of values can be tested against it
+    """
+    def __init__(self,operation,operands,result):
+        if operation not in maskFunctions:
+            print(f"ERROR: conditionPredicate: unknown operation {operation}")
+            quit()
+        self.maskFunction = maskFunctions[operation]
+        self.operands = operands
+        self.result = result
+
+    def test(self,values):
+        ''' Returns the boolean mask of the values that give the wanted result '''
+        mask = np.asarray(self.maskFunction(values,self.operands),dtype=bool)
+        if self.result:
+            return mask
+        return ~mask
+
+class whereEvaluator:
+    """ Answers count queries over a dataframe using a parsed simpleWhere, without sqlite
+
+        Each condition becomes one vectorized comparison over its column, and the
+        AND/OR structure of the WHERE tree combines the resulting masks. The select
+        list may hold count(*), count(col) and count(distinct col).
+    """
+    def __init__(self,sw):
+        self.sw = sw
+        self.table = sw.sqlTree['from']
+        self.counts = self._compileSelect(sw.sqlTree['select'])
+
+    def getMask(self,df):
+        ''' Returns the boolean mask of the rows of df that match the WHERE clause '''
+        leafMasks = []
+        for condition in self.sw.iterConditions(self.table):
+            column = df[self.sw.getColName(condition)]
+            operation = self.sw.getOperation(condition)
+            operands = self.sw.getOperands(condition)
+            if column.dtype.name == 'category':
+                # Test each category once, and spread the results by the row codes.
+                # Code -1 (a missing value) picks the False added at the end.
+                categoryMask = conditionMask(operation,operands,column.cat.categories.to_numpy())
+                leafMasks.append(np.append(categoryMask,False)[column.cat.codes.to_numpy()])
+            else:
+                leafMasks.append(conditionMask(operation,operands,column.to_numpy()))
+        return self.sw.combineLeaves(leafMasks,np.logical_and.reduce,np.logical_or.reduce)
+
+    def count(self,df):
+        ''' Returns the answer in the same form that sqlite gives it (a list holding
+            one tuple with one entry per count in the select list)
+        '''
+        mask = self.getMask(df)
+        answer = []
+        for countType,column in self.counts:
+            if countType == 'rows':
+                answer.append(int(np.count_nonzero(mask)))
+            elif countType == 'distinct':
+                answer.append(int(df[column][mask].nunique()))
+            else:
+                answer.append(int(df[column][mask].count()))
+        return [tuple(answer)]
+
+    def _compileSelect(self,select):
+        ''' Returns a list of (countType, column), countType being 'rows', 'distinct'
+            or 'nonNull'
+        '''
+        if type(select) is not list:
+            select = [select]
+        counts = []
+        for item in select:
+            value = item['value'] if type(item) is dict and 'value' in item else None
+            if type(value) is not dict or 'count' not in value:
+                print(f"ERROR: whereEvaluator: only count() is supported, got {item}")
+                quit()
+            counted = value['count']
+            if counted == '*':
+                counts.append(('rows',None))
+            elif type(counted) is dict and 'distinct' in counted:
+                counts.append(('distinct',counted['distinct']))
+            else:
+                counts.append(('nonNull',counted))
+        return counts
+
+if __name__ == "__main__":
+    import pandas as pd
+    pp = pprint.PrettyPrinter(indent=4)
+    df = pd.DataFrame({'aid1':[0,1,2,3,3,4],
+                       't1':['y','y','n','n','q','y'],
+                       'i1':[1,5,12345,12345,7,2]})
+    sqls = [
+        "select count(*) from tab where t1='y' or i1=12345",
+        "select count(distinct aid1) from tab where t1 in ('n','q') and i1 > 2",
+        "select count(distinct aid1), count(*) from tab where i1 between 2 and 7 or t1 <> 'y'",
+    ]
+    for sql in sqls:
+        we = whereEvaluator(whereParser.simpleWhere(sql))
+        print(sql)
+        pp.pprint(we.count(df))
@@ -1,5 +1,107 @@
-import moz_sql_parser as moz
+import os
+import re
+import json
+import copy
+import atexit
 import pprint
+import collections
+import lazyImport
+import phaseProfiler
+
+# moz_sql_parser (and the pyparsing it pulls in) is only loaded by the first parse
+# that misses the parse cache
+moz = lazyImport.lazyImport('moz_sql_parser')
+
+# One leaf condition of the WHERE clause. The operands are a tuple (and an IN() list
+# is itself a tuple) so that conditions are immutable and hashable.
+whereCondition = collections.namedtuple('whereCondition',['operation','colName','operands'])
+
+# A token of SQL text: a quoted string or identifier (kept as is), a run of
+# whitespace, or a run of anything else
+sqlTokens = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\s+|[^'"`\s]+|.""")
+# Whitespace between one of these and something else never changes the parse
+sqlPunctuation = "=<>!(),"
+
+def normalizeSql(sqlStr):
+    ''' Returns sqlStr with the whitespace outside of quotes collapsed, so that SQL
+        that differs only in layout maps to the same parse cache key
+    '''
+    tokens = [' ' if token.isspace() else token for token in sqlTokens.findall(sqlStr.strip())]
+    kept = []
+    for i,token in enumerate(tokens):
+        if token == ' ':
+            before = tokens[i-1][-1] in sqlPunctuation
+            after = tokens[i+1][0] in sqlPunctuation
+            if before != after:
+                continue
+        kept.append(token)
+    return ''.join(kept)
+
+class parseCache:
+    """ LRU cache of moz_sql_parser trees, keyed on normalized SQL
+
+        Holds at most maxSize trees, dropping the least recently used. Every parse
+        returns its own copy of the tree, so callers may change it. If path is given,
+        the cache is loaded from that JSON file (when it exists) and written back to
+        it at exit, so that later runs start warm.
+    """
+    def __init__(self,maxSize=1024,path=None):
+        self.maxSize = maxSize
+        self.path = path
+        self.trees = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            if os.path.exists(path):
+                self.load(path)
+            atexit.register(self.save)
+
+    def parse(self,sqlStr):
+        key = normalizeSql(sqlStr)
+        tree = self.trees.get(key)
+        if tree is None:
+            self.misses += 1
+            tree = moz.parse(sqlStr)
+            self.trees[key] = tree
+            self._evict()
+        else:
+            self.hits += 1
+            self.trees.move_to_end(key)
+        return copy.deepcopy(tree)
+
+    def clear(self):
+        self.trees.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self,path=None):
+        ''' Adds the trees saved in the JSON file at path (default self.path) '''
+        path = self.path if path is None else path
+        with open(path) as f:
+            saved = json.load(f)
+        for key,tree in saved.items():
+            self.trees[key] = tree
+        self._evict()
+
+    def save(self,path=None):
+        ''' Writes the cache to the JSON file at path (default self.path). The file is
+            replaced in one step, so a run that loads it never sees it half written.
+        '''
+        path = self.path if path is None else path
+        if path is None:
+            return
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with open(tmpPath,'w') as f:
+            json.dump(self.trees,f)
+        os.replace(tmpPath,path)
+
+    def _evict(self):
+        while len(self.trees) > self.maxSize:
+            self.trees.popitem(last=False)
+
+# The cache that simpleWhere uses unless given another. Setting WHERE_PARSE_CACHE to
+# a file path keeps it on disk across runs.
+defaultParseCache = parseCache(path=os.environ.get('WHERE_PARSE_CACHE'))
 
 class simpleWhere:
     """Parse out the WHERE clause, and get various information
@@ -11,37 +113,58 @@ class simpleWhere:
 
         All column names in the WHERE clause are of the form i1 (two letters)
         The first letter is 'i' if integer, 'r' if real, 't' if text, 'd' if date
+
+        The WHERE tree is walked once, without recursion, to make:
+            conditions: a tuple of whereCondition, one per leaf, in tree order
+            columnIndex: for each column, the positions of its conditions
+            postfix: the tree in postfix order, as ('leaf', position) and
+                ('and'/'or', number of children) entries
+
+        The SQL is parsed through a parseCache (defaultParseCache unless one is
+        given), so many simpleWheres built from the same SQL only parse it once.
+        With a phaseProfiler, the parse is timed as phase 'parse'.
     """
 
-    def __init__(self, sqlStr=None):
+    def __init__(self, sqlStr=None, cache=None, profiler=None):
         if not sqlStr:
             print("ERROR: simpleWhere: Need to define an SQL string")
             return
         self.schema = {}
         self.colTypes = {}
-        self.conditions = []
+        self.conditions = ()
+        self.columnIndex = {}
+        self.postfix = []
         self.booleanTerms = ['and','or']
         self.operators = ['eq','neq','between','gt','lt','lte','gte']
         self.sqlStr = sqlStr
-        self.sqlTree = moz.parse(sqlStr)    # The whole SQL tree
-        if 'where' not in self.sqlTree:
-            print("ERROR: simpleWhere: SQL must have WHERE clause")
-            return
-        self.wTree = self.sqlTree['where']   # The parsed WHERE clause
-        self._makeTablesColumns()
+        if cache is None:
+            cache = defaultParseCache
+        if profiler is None:
+            profiler = phaseProfiler.disabled
+        with profiler.time('parse'):
+            self.sqlTree = cache.parse(sqlStr)    # The whole SQL tree
+            if 'where' not in self.sqlTree:
+                print("ERROR: simpleWhere: SQL must have WHERE clause")
+                return
+            self.wTree = self.sqlTree['where']   # The parsed WHERE clause
+            self._makeTablesColumns()
 
     def iterConditions(self,table):
         for condition in self.conditions:
             yield condition
 
     def getColName(self,condition):
-        return condition['colName']
+        return condition.colName
 
     def getOperation(self,condition):
-        return condition['operation']
+        return condition.operation
 
     def getOperands(self,condition):
-        return condition['operands']
+        return condition.operands
+
+    def getConditionPositions(self,table,column):
+        ''' Returns the positions in the conditions of the conditions on the column '''
+        return self.columnIndex.get(column,())
 
     def iterCols(self,table):
         for col,_ in self.schema[table].items():
@@ -54,6 +177,81 @@ class simpleWhere:
     def getColType(self,table,column):
         return self.schema[table][column]['type']
 
+    def evalWhere(self,comb):
+        ''' Returns the truth value of the whole WHERE clause when the leaf conditions
+            (in the order of self.conditions) have the truth values in comb
+        '''
+        return self.combineLeaves(comb)
+
+    def combineLeaves(self,leafValues,andFunc=all,orFunc=any):
+        ''' Combines one value per condition following the AND/OR structure of the
+            WHERE clause. andFunc and orFunc take a list of values and combine them.
+        '''
+        stack = []
+        for op,arg in self.postfix:
+            if op == 'leaf':
+                stack.append(leafValues[arg])
+                continue
+            args = stack[-arg:]
+            del stack[-arg:]
+            stack.append(andFunc(args) if op == 'and' else orFunc(args))
+        return stack[0]
+
+    def getMcdcPairs(self):
+        ''' Returns one pair of leaf truth assignments per condition. The two assignments
+            of a pair differ only in that condition, and give different results for the
+            whole WHERE clause (MC/DC coverage). Conditions in an AND are held True and
+            conditions in an OR are held False so that the target condition decides.
+        '''
+        leafNodes,parents,nodes = self._makeTreeNodes()
+        pairs = []
+        for target in range(len(self.conditions)):
+            comb = [None] * len(self.conditions)
+            # Walk up from the target, setting the leaves of every sibling subtree
+            node = leafNodes[target]
+            while parents[node] is not None:
+                parent = parents[node]
+                op,_,_,children = nodes[parent]
+                for child in children:
+                    if child != node:
+                        _,start,end,_ = nodes[child]
+                        comb[start:end] = [op == 'and'] * (end - start)
+                node = parent
+            comb[target] = True
+            combTrue = tuple(comb)
+            comb[target] = False
+            combFalse = tuple(comb)
+            if self.evalWhere(combTrue) == self.evalWhere(combFalse):
+                print(f"ERROR: getMcdcPairs: condition {target} does not flip the result")
+                quit()
+            pairs.append((combTrue,combFalse))
+        return pairs
+
+    def _makeTreeNodes(self):
+        ''' Rebuilds the tree from the postfix form. Each node is (op, first leaf,
+            last leaf + 1, children). Returns the node of each leaf, the parent of
+            each node, and the nodes.
+        '''
+        nodes = []
+        parents = []
+        leafNodes = [None] * len(self.conditions)
+        stack = []
+        for op,arg in self.postfix:
+            if op == 'leaf':
+                leafNodes[arg] = len(nodes)
+                stack.append(len(nodes))
+                nodes.append((op,arg,arg+1,()))
+                parents.append(None)
+                continue
+            children = stack[-arg:]
+            del stack[-arg:]
+            for child in children:
+                parents[child] = len(nodes)
+            stack.append(len(nodes))
+            nodes.append((op,nodes[children[0]][1],nodes[children[-1]][2],tuple(children)))
+            parents.append(None)
+        return leafNodes,parents,nodes
+
     def _getColTypeFromLeaf(self,leaf):
         ''' pulls the column and type from leaf node and puts in self.colTypes '''
         operation = next(iter(leaf))
@@ -72,42 +270,69 @@ class simpleWhere:
             quit()
 
     def _getConditionFromLeaf(self,leaf):
-        ''' pulls the column and type from leaf node and puts in self.colTypes '''
+        ''' makes the whereCondition for a leaf node '''
         operation = next(iter(leaf))
         colName = leaf[operation][0]
         operands = []
         for operand in leaf[operation][1:]:
             if type(operand) is dict and next(iter(operand)) == 'literal':
                 # This is a string constant
-                operands.append(operand['literal'])
-            else:
-                operands.append(operand)
-        self.conditions.append({'operation':operation,
-                                'colName':colName,
-                                'operands':operands})
+                operand = operand['literal']
+            if type(operand) is list:
+                operand = tuple(operand)
+            operands.append(operand)
+        return whereCondition(operation,colName,tuple(operands))
 
     def _printLeaf(self,leaf):
         print(f"    {leaf}")
-    
+
     def _parseWhere(self,tree,func):
-        ''' tree is a dict '''
-        if len(tree) > 1:
-            print(f"ERROR: parseWhere: only expcted one item in tree {tree}")
-            quit()
-        key = next(iter(tree))
-        if key in self.booleanTerms:
-            for subTree in tree[key]:
-                self._parseWhere(subTree,func)
-        else:
-            func(tree)
+        ''' Calls func on every leaf of tree (a dict), in order '''
+        stack = [tree]
+        while len(stack) > 0:
+            tree = stack.pop()
+            if len(tree) > 1:
+                print(f"ERROR: parseWhere: only expcted one item in tree {tree}")
+                quit()
+            key = next(iter(tree))
+            if key in self.booleanTerms:
+                stack.extend(reversed(tree[key]))
+            else:
+                func(tree)
 
     def _makeTablesColumns(self):
         ''' For now I'm assuming only one table (no JOIN) '''
         self.schema = {}
         self.colTypes = {}
-        self._parseWhere(self.wTree, self._getColTypeFromLeaf)
-        self.conditions = []
-        self._parseWhere(self.wTree, self._getConditionFromLeaf)
+        conditions = []
+        self.columnIndex = {}
+        self.postfix = []
+        # A boolean node goes back on the stack, marked as expanded, under its children
+        # so that it comes out after them in postfix order
+        stack = [(self.wTree,False)]
+        while len(stack) > 0:
+            tree,expanded = stack.pop()
+            if len(tree) > 1:
+                print(f"ERROR: makeTablesColumns: only expcted one item in tree {tree}")
+                quit()
+            key = next(iter(tree))
+            if key in self.booleanTerms and expanded:
+                self.postfix.append((key,len(tree[key])))
+            elif key in self.booleanTerms:
+                stack.append((tree,True))
+                for subTree in reversed(tree[key]):
+                    stack.append((subTree,False))
+            else:
+                self._getColTypeFromLeaf(tree)
+                condition = self._getConditionFromLeaf(tree)
+                if condition.colName not in self.columnIndex:
+                    self.columnIndex[condition.colName] = []
+                self.columnIndex[condition.colName].append(len(conditions))
+                self.postfix.append(('leaf',len(conditions)))
+                conditions.append(condition)
+        self.conditions = tuple(conditions)
+        for colName,positions in self.columnIndex.items():
+            self.columnIndex[colName] = tuple(positions)
         self.schema[self.sqlTree['from']] = self.colTypes
 
 if __name__ == "__main__":
@@ -129,7 +354,7 @@ if __name__ == "__main__":
         sw._parseWhere(sw.wTree,sw._printLeaf)
         print("Schema (native dict):")
         pp.pprint(sw.schema)
-        print("Conditions (native dict):")
+        print("Conditions:")
         pp.pprint(sw.conditions)
         print("Tables and various values:")
         for table in sw.iterTabs():
@@ -139,4 +364,7 @@ if __name__ == "__main__":
                 print(F"        Col: {col}, Type: {sw.getColType(table,col)}")
             print(f"    Conditions:")
             for co in sw.iterConditions(table):
-                print(f"        column {sw.getColName(co)}, operation {sw.getOperation(co)}, operands {sw.getOperands(co)}")
\ No newline at end of file
+                print(f"        column {sw.getColName(co)}, operation {sw.getOperation(co)}, operands {sw.getOperands(co)}")
+        print("MC/DC pairs:")
+        for pair in sw.getMcdcPairs():
+            print(f"    {pair[0]} -> {sw.evalWhere(pair[0])}, {pair[1]} -> {sw.evalWhere(pair[1])}")
\ No newline at end of file